@@ -3,7 +3,29 @@ from uuid import UUID
 
 from database.models import Application
 from applications.schema import ApplicationsCreate, AwsCredentialsUpdate
-from helper.encryption import encrypt_value
+from helper.encryption import encrypt_value, decrypt_value, invalidate_cached_value
+from helper.aws_clients import evict_credentials
+from realtime.inventory import notify_application_change
+from realtime.backfill import queue_backfill, BACKFILL_ON_CREATE_DAYS
+
+
+def _forget_cached_credentials(application: Application):
+    """
+    Forget pooled AWS clients and cached plaintext of the application's
+    current keys.
+    """
+    if not (application.aws_access_key_id and application.aws_secret_access_key):
+        return
+    try:
+        evict_credentials(
+            decrypt_value(application.aws_access_key_id),
+            decrypt_value(application.aws_secret_access_key)
+        )
+    except ValueError:
+        # Undecryptable keys never produced a client
+        pass
+    invalidate_cached_value(application.aws_access_key_id)
+    invalidate_cached_value(application.aws_secret_access_key)
 
 
 def create_application(
@@ -39,6 +61,11 @@ def create_application(
     )
 
     db.add(application)
+    db.flush()
+    notify_application_change(db, "upsert", application.id)
+    # Charts start with CloudWatch's history instead of empty
+    if BACKFILL_ON_CREATE_DAYS > 0:
+        queue_backfill(db, application.id, BACKFILL_ON_CREATE_DAYS)
     db.commit()
     db.refresh(application)
     return application
@@ -104,7 +131,9 @@ def soft_delete_application(
     if not application:
         return False
 
+    _forget_cached_credentials(application)
     db.delete(application)
+    notify_application_change(db, "delete", application.id)
     db.commit()
     return True
 
@@ -132,10 +161,13 @@ def update_aws_credentials(
 
     if not application:
         return None
-    
+
+    # Rotated keys must not keep serving from the client pool or caches
+    _forget_cached_credentials(application)
     application.aws_access_key_id = encrypt_value(creds_in.aws_access_key_id)
     application.aws_secret_access_key = encrypt_value(creds_in.aws_secret_access_key)
-    
+    notify_application_change(db, "upsert", application.id)
+
     db.commit()
     db.refresh(application)
     return application
@@ -6,6 +6,7 @@ from typing import List
 from auth.dependency import get_current_user
 from database.database import get_db
 from database.models import User
+from realtime.aws_poller import LATEST_METRICS
 from applications.schema import ApplicationRes, ApplicationsCreate, AwsCredentialsUpdate
 from applications.repo import (
     create_application,
@@ -17,6 +18,13 @@ from applications.repo import (
 
 router = APIRouter()
 
+
+def _with_health(application) -> ApplicationRes:
+    response = ApplicationRes.model_validate(application)
+    response.poll_health = (LATEST_METRICS.get(str(application.id)) or {}).get("poll_health")
+    return response
+
+
 @router.post("", response_model=ApplicationRes, status_code=status.HTTP_201_CREATED)
 def create_app(
     app_in: ApplicationsCreate,
@@ -35,10 +43,11 @@ def list_app(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    return get_application_by_user(
+    applications = get_application_by_user(
         db,
         user_id = current_user.id
     )
+    return [_with_health(application) for application in applications]
 
 @router.get("/{app_id}", response_model=ApplicationRes)
 def get_app(
@@ -57,7 +66,7 @@ def get_app(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Application Not Found"
         )
-    return application
+    return _with_health(application)
 
 @router.delete("/{app_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_app(
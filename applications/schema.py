@@ -30,6 +30,8 @@ class ApplicationRes(BaseModel):
     aws_access_key_id: Optional[str] = None
     aws_secret_access_key: Optional[str] = None
     created_at: datetime
+    # Circuit breaker and empty-metric state reported by the poller
+    poll_health: Optional[dict] = None
 
     class Config:
         from_attributes = True
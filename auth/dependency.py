@@ -4,42 +4,50 @@ from jose import JWTError
 from sqlalchemy.orm import Session
 from uuid import UUID
 from auth.security import decode_access_token
-from database.database import get_db
+from database.database import get_db, Session_local
 from database.models import User
 
 # CHANGE: Remove the leading slash
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/login')
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-
-    
-    credential_exception = HTTPException(
+def credential_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate the credentials",
         headers={"WWW-Authenticate": "Bearer"}
     )
-    
+
+
+def user_id_from_token(token: str) -> UUID:
+    """
+    User id the access token was issued for, without touching the database
+    """
     try:
         user_id_str = decode_access_token(token)
         
-        user_id = UUID(user_id_str)
+        return UUID(user_id_str)
         
     except JWTError as e:
-        raise credential_exception
+        raise credential_exception()
     except ValueError as e:
-        raise credential_exception
+        raise credential_exception()
     except Exception as e:
         import traceback
         traceback.print_exc()
-        raise credential_exception
+        raise credential_exception()
+
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+
+    user_id = user_id_from_token(token)
     
     user = db.query(User).filter(User.id == user_id).first()
     
     if user is None:
-        raise credential_exception
+        raise credential_exception()
     
     return user
 
@@ -51,28 +59,29 @@ def get_current_user_from_query(
     """
     Get current user from token passed as query parameter (for WebSocket/SSE)
     """
-    credential_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate the credentials",
-        headers={"WWW-Authenticate": "Bearer"}
-    )
-    
-    try:
-        user_id_str = decode_access_token(token)
-        user_id = UUID(user_id_str)
-        
-    except JWTError as e:
-        raise credential_exception
-    except ValueError as e:
-        raise credential_exception
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise credential_exception
+    user_id = user_id_from_token(token)
     
     user = db.query(User).filter(User.id == user_id).first()
     
     if user is None:
-        raise credential_exception
+        raise credential_exception()
     
     return user
+
+
+def get_stream_user_id(token: str = Query(...)) -> UUID:
+    """
+    Id of the user of the token passed as query parameter, checked in a
+    session closed before returning. Streaming endpoints use it so an open
+    stream holds no pooled connection (get_db's session lives as long as
+    the response).
+    """
+    user_id = user_id_from_token(token)
+
+    with Session_local() as db:
+        found = db.query(User.id).filter(User.id == user_id).first()
+
+    if found is None:
+        raise credential_exception()
+
+    return user_id
@@ -1,8 +1,12 @@
-from sqlalchemy import create_engine
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from os import getenv
 from dotenv import load_dotenv
+from helper.telemetry import Gauge, Histogram
 
 load_dotenv()
 
@@ -11,12 +15,61 @@ DATA_BASE_URL = getenv('DATA_BASE_URL')
 if not DATA_BASE_URL:
     raise RuntimeError("DATA_BASE_URL is not set")
 
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+
 engine = create_engine(
     DATA_BASE_URL,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
     pool_size=5,
     max_overflow=10
 )
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Database connections currently checked out of the pool",
+    function=lambda: engine.pool.checkedout()
+)
+
+# Set by the streaming endpoints, so the connections their requests check
+# out are told apart from those of the poller and other background threads
+STREAMING_REQUEST = ContextVar("streaming_request", default=False)
+DB_STREAM_CHECKED_OUT = Gauge(
+    "db_stream_checked_out",
+    "Database connections currently checked out by streaming requests"
+)
+
+
+@event.listens_for(engine, "checkout")
+def _count_stream_checkout(dbapi_connection, connection_record, connection_proxy):
+    if STREAMING_REQUEST.get():
+        connection_record.info["streaming"] = True
+        DB_STREAM_CHECKED_OUT.inc()
+
+
+@event.listens_for(engine, "checkin")
+def _count_stream_checkin(dbapi_connection, connection_record):
+    if connection_record.info.pop("streaming", False):
+        DB_STREAM_CHECKED_OUT.dec()
+
+
 Session_local = sessionmaker(
     autocommit=False,
     autoflush=False,
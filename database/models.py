@@ -1,7 +1,7 @@
 import uuid
 
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Integer, BigInteger, Float, Sequence
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func
 
 from database.base import Base
@@ -106,3 +106,221 @@ class Application(Base):
         DateTime(timezone=True),
         server_default=func.now()
     )
+
+    # Drives the poller's incremental inventory sync
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        index=True
+    )
+
+
+# A process running the metrics poller, kept alive by its heartbeat
+class PollerWorker(Base):
+    __tablename__ = "poller_workers"
+    __table_args__ = {'schema': 'observability'}
+
+    worker_id = Column(
+        String,
+        primary_key=True
+    )
+
+    heartbeat_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+
+# Lease on one slice of the applications; only its owner polls them
+class PollerShard(Base):
+    __tablename__ = "poller_shards"
+    __table_args__ = {'schema': 'observability'}
+
+    shard_id = Column(
+        Integer,
+        primary_key=True
+    )
+
+    owner = Column(
+        String,
+        nullable=True,
+        index=True
+    )
+
+    lease_expires_at = Column(
+        DateTime(timezone=True),
+        nullable=True
+    )
+
+
+LATEST_METRICS_VERSION = Sequence("latest_metrics_version_seq", schema="observability")
+
+
+# Latest sample per application, shared by every API worker. UNLOGGED: it is
+# rebuilt by the poller, so it skips the WAL and is emptied after a crash.
+class LatestMetric(Base):
+    __tablename__ = "latest_metrics"
+    __table_args__ = {'schema': 'observability', 'prefixes': ['UNLOGGED']}
+
+    application_id = Column(
+        String,
+        primary_key=True
+    )
+
+    # Taken from LATEST_METRICS_VERSION on every write, so readers can ask
+    # for everything newer than what they hold
+    version = Column(
+        BigInteger,
+        LATEST_METRICS_VERSION,
+        nullable=False,
+        index=True
+    )
+
+    # None once the application is removed
+    payload = Column(
+        JSONB,
+        nullable=True
+    )
+
+
+# An open /metrics/stream and the applications it follows, so any worker
+# can change them; the worker holding the stream applies the change.
+# UNLOGGED: streams do not outlive a restart anyway.
+class MetricStream(Base):
+    __tablename__ = "metric_streams"
+    __table_args__ = {'schema': 'observability', 'prefixes': ['UNLOGGED']}
+
+    stream_id = Column(
+        String,
+        primary_key=True
+    )
+
+    user_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("observability.users.id", ondelete="CASCADE"),
+        nullable=False
+    )
+
+    # Application ids as strings
+    application_ids = Column(
+        JSONB,
+        nullable=False
+    )
+
+    # Raised on every change
+    version = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+
+    # Touched by the worker holding the stream; stale rows are dropped
+    seen_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+        index=True
+    )
+
+
+# Every collected datapoint, partitioned by day; old days are dropped whole.
+# The primary key (application_id, ts, metric) also serves range queries.
+class MetricSample(Base):
+    __tablename__ = "metric_samples"
+    __table_args__ = {'schema': 'observability', 'postgresql_partition_by': 'RANGE (ts)'}
+
+    application_id = Column(
+        UUID(as_uuid=True),
+        primary_key=True
+    )
+
+    ts = Column(
+        DateTime(timezone=True),
+        primary_key=True
+    )
+
+    metric = Column(
+        String,
+        primary_key=True
+    )
+
+    value = Column(
+        Float,
+        nullable=False
+    )
+
+
+# One closed min/max/sum/count/last bucket of a metric at one resolution
+class MetricRollup(Base):
+    __tablename__ = "metric_rollups"
+    __table_args__ = {'schema': 'observability'}
+
+    application_id = Column(
+        UUID(as_uuid=True),
+        primary_key=True
+    )
+
+    # Bucket width in seconds
+    resolution = Column(
+        Integer,
+        primary_key=True
+    )
+
+    bucket = Column(
+        DateTime(timezone=True),
+        primary_key=True
+    )
+
+    metric = Column(
+        String,
+        primary_key=True
+    )
+
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    sum = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+    last = Column(Float, nullable=False)
+    last_ts = Column(DateTime(timezone=True), nullable=False)
+
+
+# Progress of loading an application's CloudWatch history; resumed from
+# cursor (everything in [cursor, end_time) is loaded) after a crash
+class BackfillJob(Base):
+    __tablename__ = "backfill_jobs"
+    __table_args__ = {'schema': 'observability'}
+
+    application_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("observability.applications.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+
+    # pending, running, done or failed
+    status = Column(
+        String,
+        nullable=False,
+        default="pending"
+    )
+
+    days = Column(
+        Integer,
+        nullable=False
+    )
+
+    start_time = Column(DateTime(timezone=True), nullable=True)
+    end_time = Column(DateTime(timezone=True), nullable=True)
+    cursor = Column(DateTime(timezone=True), nullable=True)
+
+    error = Column(
+        String,
+        nullable=True
+    )
+
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now()
+    )
@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+import boto3
+from botocore.config import Config
+
+# Clients are reused across poll cycles and rebuilt after the TTL expires
+CLIENT_CACHE_TTL = int(os.getenv("AWS_CLIENT_CACHE_TTL", "3600"))  # seconds
+CLIENT_CACHE_SIZE = int(os.getenv("AWS_CLIENT_CACHE_SIZE", "256"))
+
+# Connection pool shared by all requests of one client. Calls go through
+# helper.aws_limits.call_with_limits, which does every retry within the rate
+# limits, so botocore makes a single attempt.
+CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("AWS_CLIENT_MAX_POOL_CONNECTIONS", "25")),
+    connect_timeout=5,
+    read_timeout=20,
+    tcp_keepalive=True,
+    retries={"mode": "standard", "total_max_attempts": 1}
+)
+
+_clients = OrderedDict()  # (service, region, fingerprint) -> (client, created_at)
+_lock = threading.Lock()
+
+
+def credential_identity(
+    aws_access_key_id: Optional[str],
+    aws_secret_access_key: Optional[str]
+) -> str:
+    """
+    Stable identity of an AWS key pair that never exposes the secret.
+    Applications without stored keys share the default credential chain.
+    """
+    if not (aws_access_key_id and aws_secret_access_key):
+        return "default"
+    digest = hashlib.sha256(
+        f"{aws_access_key_id}:{aws_secret_access_key}".encode()
+    ).hexdigest()[:16]
+    return f"{aws_access_key_id}:{digest}"
+
+
+def get_client(
+    service: str,
+    region: str,
+    aws_access_key_id: Optional[str] = None,
+    aws_secret_access_key: Optional[str] = None
+):
+    """
+    Return a cached boto3 client for (service, region, credentials).
+    botocore clients are thread-safe once built, so one client serves
+    every poller thread; only creation and eviction take the lock.
+    """
+    key = (service, region, credential_identity(aws_access_key_id, aws_secret_access_key))
+    now = time.monotonic()
+
+    with _lock:
+        cached = _clients.get(key)
+        if cached and now - cached[1] < CLIENT_CACHE_TTL:
+            _clients.move_to_end(key)
+            return cached[0]
+
+        # A session per client: the default session is not thread-safe
+        session = boto3.session.Session()
+        if aws_access_key_id and aws_secret_access_key:
+            client = session.client(
+                service,
+                region_name=region,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                config=CLIENT_CONFIG
+            )
+        else:
+            # Use default credentials (from environment or ~/.aws)
+            client = session.client(service, region_name=region, config=CLIENT_CONFIG)
+
+        _clients[key] = (client, now)
+        _clients.move_to_end(key)
+        while len(_clients) > CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+
+        return client
+
+
+def evict_credentials(
+    aws_access_key_id: Optional[str],
+    aws_secret_access_key: Optional[str]
+) -> int:
+    """
+    Drop every cached client built from this key pair.
+    Returns the number of evicted clients.
+    """
+    identity = credential_identity(aws_access_key_id, aws_secret_access_key)
+    with _lock:
+        stale = [key for key in _clients if key[2] == identity]
+        for key in stale:
+            del _clients[key]
+    return len(stale)
+
+
+def warm_up_clients(entries) -> int:
+    """
+    Build clients ahead of the first poll cycle so it does not pay for
+    endpoint resolution and service model loading.
+    entries: iterable of (service, region, aws_access_key_id, aws_secret_access_key)
+    """
+    count = 0
+    for service, region, aws_access_key_id, aws_secret_access_key in entries:
+        try:
+            get_client(service, region, aws_access_key_id, aws_secret_access_key)
+            count += 1
+        except Exception as e:
+            print(f"[AWS] Failed to warm up {service} client for {region}: {e}")
+    return count
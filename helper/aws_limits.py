@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import threading
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as AWSConnectionError
+from helper.telemetry import Counter
+
+
+def parse_rate_limits(value: str) -> dict:
+    """
+    Parse "GetMetricData=50,ListMetrics=25" into {api: calls per second}.
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        api, rate = item.split("=", 1)
+        limits[api.strip()] = float(rate)
+    return limits
+
+
+# Calls per second per (credential identity, region, API). The defaults are
+# CloudWatch's standard account quotas.
+AWS_RATE_LIMITS = parse_rate_limits(os.getenv("AWS_RATE_LIMITS", "GetMetricData=50,ListMetrics=25"))
+AWS_DEFAULT_RATE_LIMIT = float(os.getenv("AWS_DEFAULT_RATE_LIMIT", "20"))
+AWS_THROTTLE_MAX_RETRIES = int(os.getenv("AWS_THROTTLE_MAX_RETRIES", "5"))
+# Retries of 5xx and connection errors; botocore's own retries are off
+AWS_TRANSIENT_MAX_RETRIES = int(os.getenv("AWS_TRANSIENT_MAX_RETRIES", "2"))
+AWS_THROTTLE_BASE_DELAY = 0.2  # seconds
+AWS_THROTTLE_MAX_DELAY = 20  # seconds
+
+THROTTLE_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+
+
+class ThrottledError(Exception):
+    """
+    A call was still throttled after every retry.
+    """
+
+    def __init__(self, api: str, region: str, attempts: int):
+        super().__init__(f"{api} throttled in {region} after {attempts} attempts")
+        self.api = api
+        self.region = region
+        self.attempts = attempts
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second with bursts up to one second's worth.
+
+    The rate halves on every throttle (down to a tenth of the configured
+    one) and creeps back by 5% per successful call, so a bucket set above
+    what AWS actually grants settles near the real limit.
+    """
+
+    def __init__(self, rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+CLOUDWATCH_CALLS = Counter("cloudwatch_calls_total", "AWS API calls made", ("region", "api"))
+CLOUDWATCH_THROTTLES = Counter("cloudwatch_throttles_total", "AWS API calls throttled", ("region", "api"))
+CLOUDWATCH_ERRORS = Counter("cloudwatch_errors_total", "AWS API calls failed for other reasons", ("region", "api"))
+
+_buckets = {}  # (identity, region, api) -> TokenBucket
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(identity: str, region: str, api: str) -> TokenBucket:
+    key = (identity, region, api)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(AWS_RATE_LIMITS.get(api, AWS_DEFAULT_RATE_LIMIT))
+                _buckets[key] = bucket
+    return bucket
+
+
+def _is_throttle(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in THROTTLE_CODES
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (HTTPClientError, AWSConnectionError)):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+    return False
+
+
+def _backoff(attempt: int):
+    time.sleep(random.uniform(0, min(AWS_THROTTLE_MAX_DELAY, AWS_THROTTLE_BASE_DELAY * 2 ** attempt)))
+
+
+def call_with_limits(call, identity: str, region: str, api: str, **kwargs):
+    """
+    Run one AWS API call within its (identity, region, API) token bucket.
+    Every attempt, retries included, takes a token, so clients must not
+    retry on their own (see CLIENT_CONFIG). Throttled calls are retried with
+    full-jitter exponential backoff, and ThrottledError is raised once
+    AWS_THROTTLE_MAX_RETRIES are used up; 5xx and connection errors get
+    AWS_TRANSIENT_MAX_RETRIES.
+    """
+    bucket = get_bucket(identity, region, api)
+    throttles = failures = 0
+    while True:
+        bucket.acquire()
+        CLOUDWATCH_CALLS.inc(region, api)
+        try:
+            result = call(**kwargs)
+        except Exception as e:
+            if isinstance(e, ClientError) and _is_throttle(e):
+                bucket.throttled()
+                CLOUDWATCH_THROTTLES.inc(region, api)
+                if throttles == AWS_THROTTLE_MAX_RETRIES:
+                    raise ThrottledError(api, region, throttles + 1) from e
+                _backoff(throttles)
+                throttles += 1
+                continue
+            CLOUDWATCH_ERRORS.inc(region, api)
+            if not _is_transient(e) or failures == AWS_TRANSIENT_MAX_RETRIES:
+                raise
+            _backoff(failures)
+            failures += 1
+            continue
+        bucket.succeeded()
+        return result
@@ -1,5 +1,10 @@
 import os
-from cryptography.fernet import Fernet
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from cryptography.fernet import Fernet, MultiFernet
+from helper.telemetry import Counter, Gauge
 
 # Use environment variable for encryption key or generate one
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
@@ -10,13 +15,46 @@ if not ENCRYPTION_KEY:
     print("[WARNING] ENCRYPTION_KEY not set. Generating a temporary key for development.")
     ENCRYPTION_KEY = Fernet.generate_key().decode()
 
+# Retired keys (comma separated) that can still decrypt during key rotation
+PREVIOUS_ENCRYPTION_KEYS = [
+    key.strip() for key in os.getenv("PREVIOUS_ENCRYPTION_KEYS", "").split(",") if key.strip()
+]
+
+# Decrypted values are kept briefly so the poller does not decrypt every cycle
+CREDENTIAL_CACHE_TTL = int(os.getenv("CREDENTIAL_CACHE_TTL", "900"))  # seconds
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "20000"))
+
+_cipher = None
+_cache = OrderedDict()  # sha256(ciphertext) -> (plaintext, expires_at)
+_cache_lock = threading.Lock()
+
+CREDENTIAL_CACHE_HITS = Counter("credential_cache_hits_total", "Decryptions served from the credential cache")
+CREDENTIAL_CACHE_MISSES = Counter("credential_cache_misses_total", "Decryptions that ran Fernet")
+CREDENTIAL_CACHE_EVICTIONS = Counter("credential_cache_evictions_total", "Credentials evicted to stay within CREDENTIAL_CACHE_SIZE")
+CREDENTIAL_CACHE_ENTRIES = Gauge(
+    "credential_cache_entries",
+    "Decrypted credentials held in the cache",
+    function=lambda: len(_cache)
+)
+
 
 def get_cipher():
-    """Get Fernet cipher instance"""
-    try:
-        return Fernet(ENCRYPTION_KEY.encode() if isinstance(ENCRYPTION_KEY, str) else ENCRYPTION_KEY)
-    except Exception as e:
-        raise ValueError(f"Invalid ENCRYPTION_KEY: {str(e)}")
+    """Get the shared Fernet cipher (MultiFernet when previous keys are set)"""
+    global _cipher
+    if _cipher is None:
+        try:
+            ciphers = [
+                Fernet(key.encode() if isinstance(key, str) else key)
+                for key in [ENCRYPTION_KEY, *PREVIOUS_ENCRYPTION_KEYS]
+            ]
+        except Exception as e:
+            raise ValueError(f"Invalid ENCRYPTION_KEY: {str(e)}")
+        _cipher = MultiFernet(ciphers) if len(ciphers) > 1 else ciphers[0]
+    return _cipher
+
+
+def _cache_key(encrypted_value: str) -> str:
+    return hashlib.sha256(encrypted_value.encode()).hexdigest()
 
 
 def encrypt_value(value: str) -> str:
@@ -29,12 +67,40 @@ def encrypt_value(value: str) -> str:
 
 
 def decrypt_value(encrypted_value: str) -> str:
-    """Decrypt a sensitive value"""
+    """Decrypt a sensitive value, served from the credential cache when fresh"""
     if not encrypted_value:
         return ""
+
+    key = _cache_key(encrypted_value)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[1] > now:
+            _cache.move_to_end(key)
+            CREDENTIAL_CACHE_HITS.inc()
+            return cached[0]
+    CREDENTIAL_CACHE_MISSES.inc()
+
     cipher = get_cipher()
     try:
-        decrypted = cipher.decrypt(encrypted_value.encode())
-        return decrypted.decode()
+        decrypted = cipher.decrypt(encrypted_value.encode()).decode()
     except Exception as e:
         raise ValueError(f"Failed to decrypt value: {str(e)}")
+
+    with _cache_lock:
+        _cache[key] = (decrypted, now + CREDENTIAL_CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > CREDENTIAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+            CREDENTIAL_CACHE_EVICTIONS.inc()
+
+    return decrypted
+
+
+def invalidate_cached_value(encrypted_value: str):
+    """Drop one ciphertext from the credential cache"""
+    if not encrypted_value:
+        return
+    with _cache_lock:
+        _cache.pop(_cache_key(encrypted_value), None)
+
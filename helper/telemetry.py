@@ -0,0 +1,166 @@
+import math
+import threading
+from bisect import bisect_left
+
+# Seconds; the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+REGISTRY = []  # every metric, in definition order
+
+
+class _ThreadCells:
+    """
+    One private dict per writing thread, so updates never take a lock or
+    race with another writer. A scrape copies every thread's dict (a single
+    C-level copy, atomic under the GIL) and merges them. Only a thread's
+    first write registers its dict under a lock.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> dict:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = {}
+            self._local.cell = cell
+            with self._lock:
+                self._cells.append(cell)
+        return cell
+
+    def snapshot(self) -> list:
+        with self._lock:
+            cells = list(self._cells)
+        return [cell.copy() for cell in cells]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._cells = _ThreadCells()
+
+    def inc(self, *labels, amount: float = 1.0):
+        cell = self._cells.mine()
+        cell[labels] = cell.get(labels, 0.0) + amount
+
+    def values(self) -> dict:
+        totals = {}
+        for cell in self._cells.snapshot():
+            for labels, value in cell.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+    def render(self) -> list:
+        lines = self._header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Up/down value, or one read from a function at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def values(self) -> dict:
+        if self.function is None:
+            return super().values()
+        try:
+            return {(): float(self.function())}
+        except Exception:
+            return {}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._cells = _ThreadCells()
+
+    def observe(self, value: float, *labels):
+        cell = self._cells.mine()
+        # Per-bucket counts, then sum and count
+        counts = cell.get(labels)
+        if counts is None:
+            counts = cell[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def values(self) -> dict:
+        totals = {}
+        for cell in self._cells.snapshot():
+            for labels, counts in cell.items():
+                counts = list(counts)
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = counts
+                else:
+                    totals[labels] = [a + b for a, b in zip(total, counts)]
+        return totals
+
+    def render(self) -> list:
+        lines = self._header()
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(counts[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {counts[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,167 @@
+import os
+import re
+import time
+import threading
 import yaml
 from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
 from helper.discoveror import read_external_file
 
+# How often the config file's mtime is checked for changes
+RELOAD_CHECK_INTERVAL = float(os.getenv("METRICS_CONFIG_CHECK_INTERVAL", "5"))  # seconds
 
-def load_metrics_config():
-    file_path = read_external_file()
-    path = Path(file_path)
-    with open(path, "r") as f:
-        return yaml.safe_load(f)
-    
+# Dimension that identifies the polled target in every metrics.yaml section
+TARGET_DIMENSIONS = {
+    "ec2": "InstanceId",
+    "cwagent": "InstanceId",
+    "s3": "BucketName",
+    "lambda": "FunctionName",
+}
+
+STATISTICS = {"Average", "Sum", "Minimum", "Maximum", "SampleCount"}
+PERCENTILE = re.compile(r"^p\d{1,2}(\.\d+)?$")
+
+
+class MetricDefinition(NamedTuple):
+    key: str
+    group: str
+    namespace: str
+    metric_name: str
+    statistic: str
+    period: int
+    requires_agent: bool
+    # (name, value) pairs; a None value is filled with the polled target
+    dimensions: tuple
+
+    def dimensions_for(self, target: str) -> list:
+        return [
+            {"Name": name, "Value": target if value is None else value}
+            for name, value in self.dimensions
+        ]
+
+
+class MetricsConfig(NamedTuple):
+    groups: Mapping    # section -> tuple of MetricDefinition
+    keys: Mapping      # section -> tuple of metric keys
+    periods: Mapping   # section -> shortest period
+    mtime: float
+
+
+def _compile_metric(group: str, key: str, metric_def: dict) -> MetricDefinition:
+    where = f"metrics.yaml aws.{group}.{key}"
+
+    for field in ("namespace", "metric_name", "statistic", "period"):
+        if not metric_def.get(field):
+            raise ValueError(f"{where}: missing '{field}'")
+
+    statistic = metric_def["statistic"]
+    if statistic not in STATISTICS and not PERCENTILE.match(statistic):
+        raise ValueError(f"{where}: unsupported statistic '{statistic}'")
+
+    period = metric_def["period"]
+    if not isinstance(period, int) or period <= 0 or (period not in (1, 5, 10, 30) and period % 60):
+        raise ValueError(f"{where}: period must be 1, 5, 10, 30 or a multiple of 60, got {period!r}")
+
+    target_dimension = metric_def.get("target_dimension") or TARGET_DIMENSIONS.get(group)
+    if not target_dimension:
+        raise ValueError(f"{where}: no target dimension known for section '{group}'")
+
+    dimensions = [(target_dimension, None)]
+    if metric_def.get("storage_type"):
+        dimensions.append(("StorageType", metric_def["storage_type"]))
+    for name, value in (metric_def.get("dimensions") or {}).items():
+        dimensions.append((name, str(value)))
+
+    return MetricDefinition(
+        key=key,
+        group=group,
+        namespace=metric_def["namespace"],
+        metric_name=metric_def["metric_name"],
+        statistic=statistic,
+        period=period,
+        requires_agent=bool(metric_def.get("requires_agent")),
+        dimensions=tuple(dimensions),
+    )
+
+
+def compile_metrics_config(raw: dict, mtime: float = 0.0) -> MetricsConfig:
+    """
+    Validate the parsed YAML and freeze it into lookup-ready tuples.
+    Raises ValueError describing the first invalid entry.
+    """
+    aws_config = (raw or {}).get("aws") or {}
+    groups = {}
+    for group, metrics in aws_config.items():
+        groups[group] = tuple(
+            _compile_metric(group, key, metric_def)
+            for key, metric_def in (metrics or {}).items()
+        )
+
+    return MetricsConfig(
+        groups=MappingProxyType(groups),
+        keys=MappingProxyType({
+            group: tuple(metric.key for metric in metrics)
+            for group, metrics in groups.items()
+        }),
+        periods=MappingProxyType({
+            group: min(metric.period for metric in metrics)
+            for group, metrics in groups.items()
+            if metrics
+        }),
+        mtime=mtime,
+    )
+
+
+_compiled: Optional[MetricsConfig] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _load_compiled(force: bool = False, strict: bool = False) -> MetricsConfig:
+    global _compiled, _checked_at
+
+    path = Path(read_external_file())
+    mtime = path.stat().st_mtime
+    _checked_at = time.monotonic()
+
+    if not force and _compiled is not None and _compiled.mtime == mtime:
+        return _compiled
+
+    try:
+        with open(path, "r") as f:
+            compiled = compile_metrics_config(yaml.safe_load(f), mtime)
+    except Exception as e:
+        if _compiled is None or strict:
+            raise
+        # Keep serving the last good config until the file is fixed
+        print(f"[Config] Ignoring invalid metrics config: {e}")
+        _compiled = _compiled._replace(mtime=mtime)
+        return _compiled
+
+    if _compiled is not None:
+        print("[Config] Reloaded metrics config")
+    _compiled = compiled
+    return _compiled
+
+
+def get_metrics_config() -> MetricsConfig:
+    """
+    Compiled metrics config. The file is re-read only when its mtime changes,
+    and the mtime itself is checked at most every RELOAD_CHECK_INTERVAL.
+    """
+    config = _compiled
+    if config is not None and time.monotonic() - _checked_at < RELOAD_CHECK_INTERVAL:
+        return config
+
+    with _lock:
+        return _load_compiled()
+
+
+def reload_metrics_config() -> MetricsConfig:
+    """
+    Recompile the metrics config now, whatever its mtime. Raises when the
+    file is invalid; the last good config stays in use.
+    """
+    with _lock:
+        return _load_compiled(force=True, strict=True)
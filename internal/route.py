@@ -0,0 +1,122 @@
+import os
+import time
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from helper.telemetry import Histogram, render_metrics
+from helper.yamlLoader import reload_metrics_config
+
+# Bearer token required by every /internal endpoint; they are off while unset
+INTERNAL_METRICS_TOKEN = os.getenv("INTERNAL_METRICS_TOKEN")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response headers were sent, per route",
+    ("method", "route", "status")
+)
+
+
+
+def require_internal_token(authorization: Optional[str] = Header(None)):
+    """
+    Internal endpoints expose poller, shard and pool internals, so they
+    answer only to Bearer INTERNAL_METRICS_TOKEN.
+    """
+    if not INTERNAL_METRICS_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Internal endpoints are disabled; set INTERNAL_METRICS_TOKEN"
+        )
+    if not hmac.compare_digest(authorization or "", f"Bearer {INTERNAL_METRICS_TOKEN}"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
+
+
+router = APIRouter(dependencies=[Depends(require_internal_token)])
+
+
+def route_template(scope) -> str:
+    """
+    Request path with its path parameters put back as {name}, or
+    "unmatched" when no route handled it.
+    """
+    if scope.get("route") is None:
+        return "unmatched"
+    names = {str(value).lower(): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(
+        "{" + names[segment.lower()] + "}" if segment.lower() in names else segment
+        for segment in scope["path"].split("/")
+    )
+
+
+class RequestTimer:
+    """
+    ASGI middleware timing every HTTP request by its route template, so
+    /metrics/{app_id} is one series however many applications exist.
+    Streaming responses are timed to their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code):
+            nonlocal recorded
+            recorded = True
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route_template(scope),
+                str(status_code)
+            )
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start" and not recorded:
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not recorded:
+                record(500)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def internal_metrics():
+    """
+    Poller and API internals in the Prometheus text format
+    """
+    return PlainTextResponse(
+        render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.post("/config/reload")
+def reload_config():
+    """
+    Re-read config/metrics.yaml in this worker now; other workers pick the
+    change up from its mtime within METRICS_CONFIG_CHECK_INTERVAL
+    """
+    try:
+        config = reload_metrics_config()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid metrics config: {e}"
+        )
+    return {
+        "metrics": {section: len(keys) for section, keys in config.keys.items()},
+        "mtime": config.mtime
+    }
@@ -1,3 +1,4 @@
+import os
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -12,7 +13,8 @@ from database.base import Base
 from auth.route import router as auth_router
 from applications.route import router as application_router
 from metrics.route import router as metrics_router
-from realtime.aws_poller import start_poller_thread
+from internal.route import router as internal_router, RequestTimer
+from realtime.aws_poller import start_poller_thread, stop_poller, warm_up_aws_clients
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -21,8 +23,23 @@ async def lifespan(app: FastAPI):
         conn.execute(text("CREATE SCHEMA IF NOT EXISTS observability"))
         conn.commit()
     Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        # Columns added after the table was first created
+        conn.execute(text(
+            "ALTER TABLE observability.applications "
+            "ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now()"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_observability_applications_updated_at "
+            "ON observability.applications (updated_at)"
+        ))
+        conn.commit()
     print("Database ready")
 
+    # Optionally build pooled AWS clients before the first poll cycle
+    if os.getenv("AWS_CLIENT_WARMUP", "false").lower() == "true":
+        warm_up_aws_clients()
+
     # Start background metrics poller
     start_poller_thread()
     print("Metrics poller started")
@@ -31,8 +48,8 @@ async def lifespan(app: FastAPI):
     print("API Docs: http://localhost:8000/docs\n")
 
     yield
-    # Shutdown (if needed)
-    pass
+    # Shutdown: hand this worker's shards to the others
+    stop_poller()
 
 app = FastAPI(
     title="Cloud Monitor Service",
@@ -50,15 +67,17 @@ app.add_middleware(
     ],
     allow_origin_regex=r"https://service-observability-platform(-[a-z0-9-]+)?\.vercel\.app",
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestTimer)
 
 
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
 app.include_router(application_router, prefix="/applications", tags=["Applications"])
 app.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
+app.include_router(internal_router, prefix="/internal", tags=["Internal"])
 
 @app.get("/health")
 def health():
@@ -1,70 +1,55 @@
-from datetime import datetime, timezone
-from typing import Optional
-from helper.yamlLoader import load_metrics_config
-from metrics.aws_fetcher import fetch_metric
-
-
-def collect_ec2_metrics(
-    instance_id: str, 
-    region: str, 
-    agent_installed: bool = False,
-    aws_access_key_id: Optional[str] = None,
-    aws_secret_access_key: Optional[str] = None
-):
-    config = load_metrics_config()
-    aws_config = config["aws"]
-
-    results = {
-        "instance_id": instance_id,
-        "region": region,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }
-
+from datetime import timedelta
+from helper.yamlLoader import MetricsConfig
+from metrics.aws_batch_fetcher import metric_spec
+from metrics.aws_discovery import DIMENSIONS, discovered_dimension_sets
+
+EC2_LOOKBACK = timedelta(minutes=15)
+
+
+def build_ec2_metric_specs(
+    config: MetricsConfig,
+    instance_id: str,
+    agent_installed: bool = False
+) -> list:
+    """
+    Build the metric specs of one EC2 instance from the compiled config.
+    CWAgent metrics use the dimension sets discovered for the instance when
+    known (one spec per mount), else the dimensions configured.
+    """
     # ---------------- EC2 NATIVE METRICS ----------------
-    for metric_key, metric_def in aws_config.get("ec2", {}).items():
-        dimensions = [{"Name": "InstanceId", "Value": instance_id}]
-
-        value = fetch_metric(
-            region=region,
-            namespace=metric_def["namespace"],
-            metric_name=metric_def["metric_name"],
-            statistic=metric_def["statistic"],
-            dimensions=dimensions,
-            period=metric_def["period"],
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
-
-        results[metric_key] = value
+    specs = [metric_spec(metric, instance_id) for metric in config.groups.get("ec2", ())]
 
     # ---------------- CWAGENT METRICS ----------------
-    for metric_key, metric_def in aws_config.get("cwagent", {}).items():
+    for metric in config.groups.get("cwagent", ()):
 
         # Respect requires_agent flag
-        if metric_def.get("requires_agent") and not agent_installed:
-            results[metric_key] = None
+        if metric.requires_agent and not agent_installed:
             continue
 
-        dimensions = [{"Name": "InstanceId", "Value": instance_id}]
-
-        # Disk metrics require extra dimensions
-        if metric_def["metric_name"].startswith("disk"):
-            dimensions.extend([
-                {"Name": "path", "Value": "/"},
-                {"Name": "fstype", "Value": "xfs"}  # adjust if needed
-            ])
-
-        value = fetch_metric(
-            region=region,
-            namespace=metric_def["namespace"],
-            metric_name=metric_def["metric_name"],
-            statistic=metric_def["statistic"],
-            dimensions=dimensions,
-            period=metric_def["period"],
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
-
-        results[metric_key] = value
+        discovered = DIMENSIONS.get(metric.namespace, instance_id)
+        if discovered is None:
+            specs.append(metric_spec(metric, instance_id))
+            continue
 
-    return results
+        for key, dimensions in discovered_dimension_sets(metric, discovered):
+            specs.append(dict(metric_spec(metric, instance_id), key=key, dimensions=dimensions))
+
+    return specs
+
+
+def format_ec2_metrics(metrics: dict) -> dict:
+    """
+    Dashboard view of an EC2 sample; network in MiB.
+    """
+    network_in = metrics.get("network_in_bytes", 0) or 0
+    network_out = metrics.get("network_out_bytes", 0) or 0
+    return {
+        "timestamp": metrics.get("collected_at"),
+        "cpu": metrics.get("cpu_utilization", 0) or 0,
+        "memory": metrics.get("memory_used_percent", 0) or 0,
+        "network_in": network_in / (1024 * 1024),
+        "network_out": network_out / (1024 * 1024),
+        "network": (network_in + network_out) / (1024 * 1024),
+        "disk": metrics.get("disk_used_percent", 0) or 0,
+        "error": metrics.get("error")
+    }
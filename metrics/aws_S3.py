@@ -1,34 +1,26 @@
-from datetime import datetime, timezone
-from typing import Optional
-from helper.yamlLoader import load_metrics_config
-from metrics.aws_S3_fetcher import fetch_S3_metrics
+from datetime import timedelta
+from helper.yamlLoader import MetricsConfig
+from metrics.aws_batch_fetcher import metric_spec
 
-def collect_S3_metrics(
-        bucket_name: str,
-        region: str,
-        aws_access_key_id: Optional[str] = None,
-        aws_secret_access_key: Optional[str] = None,
-):
-    config = load_metrics_config()
-    aws_config = config["aws"]
-    results = {
-        "bucket_name": bucket_name,
-        "region": region,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }
+# S3 storage metrics are published once a day
+S3_LOOKBACK = timedelta(days=7)
+
+
+def build_S3_metric_specs(config: MetricsConfig, bucket_name: str) -> list:
+    """
+    Build the metric specs of one S3 bucket from the compiled config.
+    """
     # ---------------- S3 NATIVE METRICS ----------------
-    for metric_key, metric_def in aws_config.get("s3", {}).items():
-        dimensions = [{"Name": "BucketName", "Value": bucket_name}]
-        value = fetch_S3_metrics(
-            region=region,
-            namespace=metric_def["namespace"],
-            metric_name=metric_def["metric_name"],
-            statistic=metric_def["statistic"],
-            dimensions=dimensions,
-            period=metric_def["period"],
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
-        results[metric_key] = value
-    
-    return results
\ No newline at end of file
+    return [metric_spec(metric, bucket_name) for metric in config.groups.get("s3", ())]
+
+
+def format_S3_metrics(metrics: dict) -> dict:
+    """
+    Dashboard view of an S3 sample.
+    """
+    return {
+        "timestamp": metrics.get("collected_at"),
+        "bucket_size_bytes": metrics.get("bucket_size_bytes", 0) or 0,
+        "number_of_objects": metrics.get("number_of_objects", 0) or 0,
+        "error": metrics.get("error")
+    }
@@ -0,0 +1,138 @@
+from datetime import datetime
+from typing import Callable, Optional
+from helper.aws_clients import get_client, credential_identity
+from helper.aws_limits import call_with_limits
+
+# GetMetricData accepts at most 500 queries per request
+MAX_QUERIES_PER_REQUEST = 500
+
+
+def metric_spec(metric, target: str) -> dict:
+    """
+    Describe one compiled metric definition for one target
+    (instance, bucket, function).
+    """
+    return {
+        "key": metric.key,
+        "group": metric.group,
+        "namespace": metric.namespace,
+        "metric_name": metric.metric_name,
+        "statistic": metric.statistic,
+        "period": metric.period,
+        "dimensions": metric.dimensions_for(target),
+    }
+
+
+def query_signature(spec: dict) -> tuple:
+    """
+    Canonical identity of the CloudWatch query a spec needs; specs with the
+    same signature (in the same region and account) get the same datapoints.
+    """
+    return (
+        spec["namespace"],
+        spec["metric_name"],
+        tuple(sorted((d["Name"], d["Value"]) for d in spec["dimensions"])),
+        spec["statistic"],
+        spec["period"],
+    )
+
+
+def metric_query(query_id: str, spec: dict) -> dict:
+    """
+    GetMetricData query for one spec.
+    """
+    return {
+        "Id": query_id,
+        "MetricStat": {
+            "Metric": {
+                "Namespace": spec["namespace"],
+                "MetricName": spec["metric_name"],
+                "Dimensions": spec["dimensions"],
+            },
+            "Period": spec["period"],
+            "Stat": spec["statistic"],
+        },
+        "ReturnData": True,
+    }
+
+
+def build_metric_queries(specs: list, id_prefix: str = "q"):
+    """
+    Turn metric specs into GetMetricData queries.
+    Specs asking for the same metric, statistic and period share one query.
+    Returns (queries, query_keys) where query_keys maps a query id to the
+    result keys it feeds.
+    """
+    queries = []
+    query_keys = {}
+    seen = {}
+
+    for spec in specs:
+        signature = query_signature(spec)
+        query_id = seen.get(signature)
+
+        if query_id is None:
+            query_id = f"{id_prefix}{len(queries)}"
+            seen[signature] = query_id
+            query_keys[query_id] = []
+            queries.append(metric_query(query_id, spec))
+
+        query_keys[query_id].append(spec["key"])
+
+    return queries, query_keys
+
+
+def fetch_metric_data(
+    region: str,
+    queries: list,
+    start_time: datetime,
+    end_time: datetime,
+    aws_access_key_id: Optional[str] = None,
+    aws_secret_access_key: Optional[str] = None,
+    before_request: Optional[Callable[[], None]] = None
+) -> dict:
+    """
+    Run GetMetricData for the queries, 500 per request, following NextToken.
+    Returns the datapoints of every query id as (timestamp, value) pairs.
+    before_request, when given, is called before every API call (e.g. to pace them).
+    """
+    cloudwatch = get_client(
+        "cloudwatch",
+        region,
+        aws_access_key_id,
+        aws_secret_access_key
+    )
+
+    identity = credential_identity(aws_access_key_id, aws_secret_access_key)
+    datapoints = {query["Id"]: [] for query in queries}
+
+    for offset in range(0, len(queries), MAX_QUERIES_PER_REQUEST):
+        request = {
+            "MetricDataQueries": queries[offset:offset + MAX_QUERIES_PER_REQUEST],
+            "StartTime": start_time,
+            "EndTime": end_time,
+            "ScanBy": "TimestampDescending",
+        }
+
+        while True:
+            if before_request is not None:
+                before_request()
+            response = call_with_limits(
+                cloudwatch.get_metric_data,
+                identity,
+                region,
+                "GetMetricData",
+                **request
+            )
+
+            for result in response.get("MetricDataResults", []):
+                datapoints[result["Id"]].extend(
+                    zip(result.get("Timestamps", []), result.get("Values", []))
+                )
+
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+            request["NextToken"] = next_token
+
+    return datapoints
@@ -0,0 +1,181 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+from helper.aws_clients import get_client, credential_identity
+from helper.aws_limits import call_with_limits
+
+# How long the dimension sets found for an instance are trusted
+DIMENSION_DISCOVERY_TTL = int(os.getenv("DIMENSION_DISCOVERY_TTL", "3600"))  # seconds
+# ListMetrics sweeps in flight, apart from the poller's GetMetricData calls
+DIMENSION_DISCOVERY_WORKERS = int(os.getenv("DIMENSION_DISCOVERY_WORKERS", "4"))
+# Retry sooner when discovery failed, so a fixed permission takes effect
+DIMENSION_DISCOVERY_RETRY = 300  # seconds
+
+
+def list_metric_dimensions(
+    region: str,
+    namespace: str,
+    dimension: str,
+    value: str,
+    aws_access_key_id: Optional[str] = None,
+    aws_secret_access_key: Optional[str] = None
+) -> dict:
+    """
+    Every dimension set published in a namespace for one target, following
+    ListMetrics pagination. Returns {metric_name: [dimensions, ...]} with
+    each dimension list in the GetMetricData shape.
+    """
+    cloudwatch = get_client(
+        "cloudwatch",
+        region,
+        aws_access_key_id,
+        aws_secret_access_key
+    )
+    identity = credential_identity(aws_access_key_id, aws_secret_access_key)
+
+    found = {}
+    request = {
+        "Namespace": namespace,
+        "Dimensions": [{"Name": dimension, "Value": value}],
+    }
+    while True:
+        response = call_with_limits(
+            cloudwatch.list_metrics,
+            identity,
+            region,
+            "ListMetrics",
+            **request
+        )
+        for metric in response.get("Metrics", []):
+            dimensions = sorted(
+                ({"Name": d["Name"], "Value": d["Value"]} for d in metric.get("Dimensions", [])),
+                key=lambda d: d["Name"]
+            )
+            found.setdefault(metric["MetricName"], []).append(dimensions)
+
+        next_token = response.get("NextToken")
+        if not next_token:
+            break
+        request["NextToken"] = next_token
+
+    return found
+
+
+class DimensionCache:
+    """
+    Dimension sets discovered per (namespace, target), refreshed every
+    DIMENSION_DISCOVERY_TTL. Instance ids are unique across regions and
+    accounts, so the target alone identifies an entry.
+
+    Entries are kept in the order they were stored; ones expired for a
+    whole TTL (targets no longer polled) are dropped from the front.
+    """
+
+    def __init__(self, ttl: float = DIMENSION_DISCOVERY_TTL):
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (namespace, target) -> (expires_at, {metric_name: [dimensions]})
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, target: str) -> Optional[dict]:
+        """
+        Discovered {metric_name: [dimensions, ...]}, or None when unknown.
+        An expired entry is still returned until it is refreshed.
+        """
+        entry = self._entries.get((namespace, target))
+        return entry[1] if entry is not None else None
+
+    def is_fresh(self, namespace: str, target: str, now: float) -> bool:
+        entry = self._entries.get((namespace, target))
+        return entry is not None and entry[0] > now
+
+    def put(self, namespace: str, target: str, metrics: Optional[dict], now: float, ttl: float = None):
+        """
+        Store a discovery result; None keeps the previous metrics (if any)
+        and only sets when to look again.
+        """
+        key = (namespace, target)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if metrics is None:
+                metrics = previous[1] if previous is not None else None
+            self._entries[key] = (now + (self.ttl if ttl is None else ttl), metrics)
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if self._entries[oldest][0] > now - self.ttl:
+                    break
+                del self._entries[oldest]
+
+    def refresh(
+        self,
+        region: str,
+        namespace: str,
+        dimension: str,
+        target: str,
+        aws_access_key_id: Optional[str] = None,
+        aws_secret_access_key: Optional[str] = None
+    ) -> dict:
+        """
+        Discover the dimension sets of one target now. A failure is retried
+        after DIMENSION_DISCOVERY_RETRY, keeping what was known before.
+        """
+        now = time.time()
+        try:
+            metrics = list_metric_dimensions(
+                region,
+                namespace,
+                dimension,
+                target,
+                aws_access_key_id,
+                aws_secret_access_key
+            )
+        except Exception:
+            self.put(namespace, target, None, now, ttl=DIMENSION_DISCOVERY_RETRY)
+            raise
+        self.put(namespace, target, metrics, now)
+        return metrics
+
+
+DIMENSIONS = DimensionCache()
+
+
+def _matches(dimensions: list, wanted: tuple) -> int:
+    values = {d["Name"]: d["Value"] for d in dimensions}
+    return sum(1 for name, value in wanted if value is not None and values.get(name) == value)
+
+
+def discovered_dimension_sets(metric, discovered: dict) -> list:
+    """
+    (key, dimensions) pairs to query for a metric from the dimension sets
+    discovered for the target, one per distinct value of the dimensions the
+    config names (one per mount for disk metrics). The set closest to the
+    configured values keeps the plain metric key; the others get
+    'key{name=value,...}'. Empty when the target publishes no such metric.
+    """
+    labels = [name for name, value in metric.dimensions if value is not None]
+
+    # Per label combination, the set with the fewest extra dimensions
+    # (the agent may also publish copies with ImageId, InstanceType...)
+    by_label = {}
+    for dimensions in discovered.get(metric.metric_name, ()):
+        values = {d["Name"]: d["Value"] for d in dimensions}
+        label = tuple((name, values.get(name)) for name in labels)
+        current = by_label.get(label)
+        if current is None or len(dimensions) < len(current):
+            by_label[label] = dimensions
+    if not by_label:
+        return []
+
+    primary = max(
+        sorted(by_label, key=str),
+        key=lambda label: _matches(by_label[label], metric.dimensions)
+    )
+    pairs = []
+    for label in sorted(by_label, key=str):
+        if label == primary:
+            key = metric.key
+        else:
+            key = metric.key + "{" + ",".join(f"{name}={value}" for name, value in label) + "}"
+        pairs.append((key, by_label[label]))
+    return pairs
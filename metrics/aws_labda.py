@@ -1,34 +1,29 @@
-from datetime import datetime, timedelta, timezone
-from typing import Optional
-from helper.yamlLoader import load_metrics_config
-from metrics.aws_lamda_fetcher import fetch_lambda_metrics
+from datetime import timedelta
+from helper.yamlLoader import MetricsConfig
+from metrics.aws_batch_fetcher import metric_spec
 
-def collect_lambda_metrics(
-        function_name: str,
-        region: str,
-        aws_access_key_id: Optional[str] = None,
-        aws_secret_access_key: Optional[str] = None,
-):
-    config = load_metrics_config()
-    aws_config = config["aws"]
-    results = {
-        "function_name": function_name,
-        "region": region,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-    }
+LAMBDA_LOOKBACK = timedelta(hours=24)
+
+
+def build_lambda_metric_specs(config: MetricsConfig, function_name: str) -> list:
+    """
+    Build the metric specs of one Lambda function from the compiled config.
+    """
     # ---------------- LAMBDA NATIVE METRICS ----------------
-    for metric_key, metric_def in aws_config.get("lambda", {}).items():
-        dimensions = [{"Name": "FunctionName", "Value": function_name}]
-        value = fetch_lambda_metrics(
-            region=region,
-            namespace=metric_def["namespace"],
-            metric_name=metric_def["metric_name"],
-            statistic=metric_def["statistic"],
-            dimensions=dimensions,
-            period=metric_def["period"],
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
-        results[metric_key] = value
-    
-    return results
\ No newline at end of file
+    return [metric_spec(metric, function_name) for metric in config.groups.get("lambda", ())]
+
+
+def format_lambda_metrics(metrics: dict) -> dict:
+    """
+    Dashboard view of a Lambda sample; durations in milliseconds.
+    """
+    return {
+        "timestamp": metrics.get("collected_at"),
+        "invocations": metrics.get("invocations", 0) or 0,
+        "errors": metrics.get("errors", 0) or 0,
+        "throttles": metrics.get("throttles", 0) or 0,
+        "duration_avg": metrics.get("duration_avg", 0) or 0,
+        "duration_max": metrics.get("duration_max", 0) or 0,
+        "concurrent_executions": metrics.get("concurrent_executions", 0) or 0,
+        "error": metrics.get("error")
+    }
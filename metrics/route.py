@@ -1,91 +1,418 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from uuid import UUID
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 import json
 import asyncio
 
-from database.database import get_db
-from auth.dependency import get_current_user, get_current_user_from_query
+from database.database import get_db, Session_local, STREAMING_REQUEST
+from auth.dependency import get_current_user, get_stream_user_id
 from database.models import User, Application
-from realtime.aws_poller import LATEST_METRICS
+from realtime.aws_poller import LATEST_METRICS, ROLLUPS, RECENT, HUB, FRAMES, STREAMS
+from realtime.frames import HEARTBEAT_FRAME, changed_fields
+from metrics.schema import StreamChange
+from realtime.history import query_history, HISTORY_MAX_POINTS
+from realtime.rollup import query_rollups, ROLLUP_RESOLUTIONS, ROLLUP_DEFAULT_WINDOWS
+from realtime.ring_buffer import RING_BUFFER_WINDOW
+from helper.telemetry import Gauge
 
 router = APIRouter(tags=["metrics"])
 
-@router.get("/{app_id}/realtime")
+SSE_CONNECTIONS = Gauge("sse_connections", "Open Server-Sent Events streams")
+WS_CONNECTIONS = Gauge("websocket_connections", "Open metrics WebSockets")
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+
+def owned_app_ids(db: Session, user_id, app_ids: Optional[List[UUID]] = None) -> List[str]:
+    """
+    Ids of the user's active applications among app_ids (all of them when
+    None), checked with one query
+    """
+    query = db.query(Application.id).filter(
+        Application.user_id == user_id,
+        Application.is_active.is_(True)
+    )
+    if app_ids is not None:
+        query = query.filter(Application.id.in_(app_ids))
+    return [str(row.id) for row in query.all()]
+
+
+def stream_app_ids(user_id, app_ids: Optional[List[UUID]] = None) -> List[str]:
+    """
+    owned_app_ids in a session of its own, closed before the stream starts
+    """
+    with Session_local() as db:
+        return owned_app_ids(db, user_id, app_ids)
+
+
+def require_found(app_ids: List[UUID], owned: List[str]):
+    """
+    404 naming the requested ids that are not the user's
+    """
+    unknown = sorted({str(app_id) for app_id in app_ids} - set(owned))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Applications not found: {', '.join(unknown)}"
+        )
+
+
+async def streaming_request():
+    """
+    Count the request's database connections in db_stream_checked_out.
+    Async, so it is set in the request's own context before the other
+    dependencies run.
+    """
+    STREAMING_REQUEST.set(True)
+
+@router.get("/stream", dependencies=[Depends(streaming_request)])
+async def stream_many_metrics(
+    app_ids: Optional[List[UUID]] = Query(None),
+    user_id: UUID = Depends(get_stream_user_id)
+):
+    """
+    Stream real-time metrics of several applications (default: all of the
+    user's) over one Server-Sent Events connection. The first event names
+    the stream; PATCH /metrics/stream/{stream_id}, through any worker,
+    changes its applications.
+    """
+    # Checked off the event loop; no database connection is held while streaming
+    followed = await asyncio.to_thread(stream_app_ids, user_id, app_ids)
+    if app_ids is not None:
+        require_found(app_ids, followed)
+
+    async def event_generator():
+        """Send each changed application's frame, tagged with its id"""
+        SSE_CONNECTIONS.inc()
+        # Subscribed here, so a client gone before the stream starts leaves none behind
+        subscription = None
+        try:
+            subscription = await HUB.subscribe(followed, user_id=user_id, register=True)
+            opening = json.dumps({"stream_id": subscription.id, "application_ids": followed})
+            yield f"event: stream\ndata: {opening}\n\n".encode()
+            async for changed in HUB.updates(subscription):
+                if changed is None:
+                    yield HEARTBEAT_FRAME
+                else:
+                    yield b"".join(frame.tagged for _, frame in changed)
+        finally:
+            if subscription is not None:
+                HUB.close(subscription)
+            SSE_CONNECTIONS.dec()
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def apply_stream_change(user_id, stream_id: str, change: StreamChange):
+    """
+    Check the added applications and record the change in the stream
+    registry, in a session of its own; run off the event loop.
+    """
+    with Session_local() as db:
+        added = []
+        if change.add:
+            added = owned_app_ids(db, user_id, change.add)
+            require_found(change.add, added)
+        return STREAMS.change(db, stream_id, user_id, added, [str(app_id) for app_id in change.remove])
+
+@router.patch("/stream/{stream_id}")
+async def change_stream(
+    stream_id: str,
+    change: StreamChange,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Add applications to or remove them from an open /metrics/stream without
+    reconnecting. Any worker takes the change; the one holding the stream
+    applies it at once when it is this one, else within HUB_CHECK_INTERVAL.
+    """
+    # The row lock and commit must not stall this worker's open streams
+    changed = await asyncio.to_thread(apply_stream_change, current_user.id, stream_id, change)
+    if changed is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Stream not found"
+        )
+    version, app_ids = changed
+
+    subscription = HUB.find(stream_id)
+    if subscription is not None:
+        await HUB.apply_change(subscription, version, app_ids)
+
+    return {
+        "stream_id": stream_id,
+        "application_ids": sorted(app_ids)
+    }
+
+def ws_update(kind: str, seq: int, app_id: str, version: int, data: str) -> str:
+    return '{"type":"%s","seq":%d,"application_id":"%s","version":%d,"data":%s}' % (
+        kind, seq, app_id, version, data
+    )
+
+@router.websocket("/ws", dependencies=[Depends(streaming_request)])
+async def metrics_websocket(
+    websocket: WebSocket,
+    token: str = Query(...),
+    app_ids: Optional[List[UUID]] = Query(None)
+):
+    """
+    Real-time metrics of several applications (default: all of the user's)
+    over one WebSocket. Each application starts with a "snapshot" of the
+    formatted metrics, then "delta" messages carry only the fields that
+    changed; "seq" numbers the updates of the connection. Clients send
+    {"type": "subscribe" | "unsubscribe", "app_ids": [...]}. Messages are
+    compressed with permessage-deflate when the client offers it.
+    """
+    # Same short-lived checks as the SSE streams
+    try:
+        user_id = await asyncio.to_thread(get_stream_user_id, token)
+        followed = await asyncio.to_thread(stream_app_ids, user_id, app_ids)
+        if app_ids is not None:
+            require_found(app_ids, followed)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    subscription = await HUB.subscribe(followed, user_id=user_id)
+    sent = {}  # app_id -> last Frame sent
+    seq = 0
+    sending = asyncio.Lock()
+
+    async def send(text: str):
+        async with sending:
+            await websocket.send_text(text)
+
+    async def push():
+        """Send each changed application's snapshot or delta"""
+        nonlocal seq
+        async for changed in HUB.updates(subscription):
+            # Idle sockets are kept open by the server's pings
+            for app_id, frame in changed or ():
+                if app_id not in subscription.app_ids:
+                    continue
+                last = sent.get(app_id)
+                if last is frame:
+                    continue
+                if last is None or frame.version <= last.version:
+                    kind, data = "snapshot", frame.payload.decode()
+                elif frame.version == last.version + 1:
+                    kind, data = "delta", frame.changes
+                else:
+                    # Versions were coalesced; diff against what this client has
+                    kind, data = "delta", json.dumps(changed_fields(last.formatted, frame.formatted))
+                sent[app_id] = frame
+                seq += 1
+                await send(ws_update(kind, seq, app_id, frame.version, data))
+
+    async def listen():
+        """Apply the client's subscribe and unsubscribe messages"""
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message["type"]
+                requested = [UUID(str(app_id)) for app_id in message["app_ids"]]
+            except (ValueError, KeyError, TypeError):
+                await send(json.dumps({
+                    "type": "error",
+                    "detail": 'Expected {"type": "subscribe" | "unsubscribe", "app_ids": [...]}'
+                }))
+                continue
+
+            if kind == "subscribe":
+                owned = await asyncio.to_thread(stream_app_ids, user_id, requested)
+                await HUB.add(subscription, owned)
+                unknown = sorted({str(app_id) for app_id in requested} - set(owned))
+                if unknown:
+                    await send(json.dumps({
+                        "type": "error",
+                        "detail": f"Applications not found: {', '.join(unknown)}"
+                    }))
+            elif kind == "unsubscribe":
+                removed = [str(app_id) for app_id in requested]
+                HUB.remove(subscription, removed)
+                for app_id in removed:
+                    # A later subscribe starts over with a snapshot
+                    sent.pop(app_id, None)
+            else:
+                await send(json.dumps({"type": "error", "detail": f"Unknown message type: {kind}"}))
+                continue
+
+            await send(json.dumps({"type": "subscribed", "app_ids": sorted(subscription.app_ids)}))
+
+    WS_CONNECTIONS.inc()
+    tasks = [asyncio.create_task(push()), asyncio.create_task(listen())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"[WebSocket] Closed after error: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        HUB.close(subscription)
+        WS_CONNECTIONS.dec()
+
+@router.get("/{app_id}/realtime", dependencies=[Depends(streaming_request)])
 async def stream_realtime_metrics(
     app_id: UUID,
-    current_user: User = Depends(get_current_user_from_query),
-    db: Session = Depends(get_db)
+    user_id: UUID = Depends(get_stream_user_id)
 ):
     """
     Stream real-time metrics using Server-Sent Events (SSE)
     """
+    # Verify application belongs to user; no database connection is held
+    # while streaming
+    if not await asyncio.to_thread(stream_app_ids, user_id, [app_id]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Application not found"
+        )
+    
+    async def event_generator():
+        """Send a frame whenever the poller publishes a new sample"""
+        SSE_CONNECTIONS.inc()
+        subscription = None
+        try:
+            subscription = await HUB.subscribe([str(app_id)], user_id=user_id)
+            async for changed in HUB.updates(subscription):
+                # Frames are formatted and serialized once for every viewer
+                yield HEARTBEAT_FRAME if changed is None else changed[0][1].data
+        finally:
+            if subscription is not None:
+                HUB.close(subscription)
+            SSE_CONNECTIONS.dec()
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/{app_id}/history")
+def get_metrics_history(
+    app_id: UUID,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    step: int = Query(60, ge=1),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Collected metrics between from and to (default: the last hour),
+    averaged per step seconds
+    """
     # Verify application belongs to user
     application = db.query(Application).filter(
         Application.id == app_id,
         Application.user_id == current_user.id,
         Application.is_active.is_(True)
     ).first()
-    
+
     if not application:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Application not found"
         )
-    
-    async def event_generator():
-        """Generate SSE events"""
-        while True:
-            # Get latest metrics for this application
-            metrics = LATEST_METRICS.get(str(app_id), {})
-            
-            if metrics:
-                # Check collector type and format accordingly
-                if application.collector_type == "s3":
-                    formatted = {
-                        "timestamp": metrics.get("collected_at"),
-                        "bucket_size_bytes": metrics.get("bucket_size_bytes", 0) or 0,
-                        "number_of_objects": metrics.get("number_of_objects", 0) or 0,
-                        "error": metrics.get("error")
-                    }
-                else:  # EC2 - REPLACE THE OLD formatted DICTIONARY WITH THIS
-                    formatted = {
-                        "timestamp": metrics.get("collected_at"),
-                        "cpu": metrics.get("cpu_utilization", 0) or 0,
-                        "memory": metrics.get("memory_used_percent", 0) or 0,
-                        "network_in": (metrics.get("network_in_bytes", 0) or 0) / (1024 * 1024),
-                        "network_out": (metrics.get("network_out_bytes", 0) or 0) / (1024 * 1024),
-                        "network": ((metrics.get("network_in_bytes", 0) or 0) + (metrics.get("network_out_bytes", 0) or 0)) / (1024 * 1024),
-                        "disk": metrics.get("disk_used_percent", 0) or 0,
-                        "error": metrics.get("error")
-                    }
-                
-                # Send as SSE
-                yield f"data: {json.dumps(formatted)}\n\n"
-            
-            await asyncio.sleep(5)
-    # Send updates every 5 seconds
 
-    
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    end = to or datetime.now(timezone.utc)
+    start = from_ or end - timedelta(hours=1)
+    # Naive timestamps are taken as UTC
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' must be before 'to'"
+        )
+    if (end - start).total_seconds() / step > HISTORY_MAX_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range too large for step; at most {HISTORY_MAX_POINTS} points per metric"
+        )
+
+    return {
+        "application_id": str(app_id),
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "step": step,
+        "series": query_history(db, app_id, start, end, step)
+    }
+
+@router.get("/{app_id}/rollup")
+def get_metrics_rollup(
+    app_id: UUID,
+    resolution: str = "1h",
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Pre-aggregated min/max/avg/sum/count/last buckets at 1m, 5m, 1h or 1d
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}"
+        )
+
+    # Verify application belongs to user
+    application = db.query(Application).filter(
+        Application.id == app_id,
+        Application.user_id == current_user.id,
+        Application.is_active.is_(True)
+    ).first()
+
+    if not application:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Application not found"
+        )
+
+    end = to or datetime.now(timezone.utc)
+    start = from_ or end - ROLLUP_DEFAULT_WINDOWS[resolution]
+    # Naive timestamps are taken as UTC
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+
+    seconds = ROLLUP_RESOLUTIONS[resolution]
+    if (end - start).total_seconds() / seconds > HISTORY_MAX_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range too large for resolution; at most {HISTORY_MAX_POINTS} buckets per metric"
+        )
+
+    return {
+        "application_id": str(app_id),
+        "resolution": resolution,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "series": query_rollups(
+            db, app_id, seconds, start, end,
+            open_buckets=ROLLUPS.open_buckets(str(app_id), seconds)
+        )
+    }
 
 @router.get("/{app_id}")
 def get_latest_metrics(
     app_id: UUID,
+    minutes: Optional[int] = Query(None, ge=1, le=max(1, RING_BUFFER_WINDOW // 60)),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Get the latest metrics snapshot for an application
+    Get the latest metrics snapshot for an application, plus the samples of
+    the last `minutes` when asked for
     """
     # Verify application belongs to user
     application = db.query(Application).filter(
@@ -108,28 +435,16 @@ def get_latest_metrics(
             "message": "No metrics available yet",
             "application_id": str(app_id)
         }
-    
-    # Format response based on collector type
-    if application.collector_type == "s3":
-        formatted = {
-            "bucket_size_bytes": metrics.get("bucket_size_bytes", 0) or 0,
-            "number_of_objects": metrics.get("number_of_objects", 0) or 0
-        }
-    else:
-        formatted = {
-            "cpu": metrics.get("cpu_utilization", 0) or 0,
-            "memory": metrics.get("memory_used_percent", 0) or 0,
-            "network": (
-                (metrics.get("network_in_bytes", 0) or 0) + 
-                (metrics.get("network_out_bytes", 0) or 0)
-            ) / (1024 * 1024),
-            "disk": metrics.get("disk_used_percent", 0) or 0
-        }
-    
-    # Format response
-    return {
-        "application_id": str(app_id),
-        "timestamp": metrics.get("collected_at"),
-        "metrics": metrics,
-        "formatted": formatted  # <-- This now uses the conditional formatting above
-    }
+
+    extra = {}
+    if minutes:
+        since = int(datetime.now(timezone.utc).timestamp()) - minutes * 60
+        recent = RECENT.since(str(app_id), since)
+        extra["recent"] = recent.to_json() if recent is not None else {"timestamps": [], "metrics": {}}
+
+    # The formatted view and sample JSON are cached once per update
+    frame = FRAMES.get(str(app_id), metrics)
+    return Response(
+        content=frame.snapshot(str(app_id), extra),
+        media_type="application/json"
+    )
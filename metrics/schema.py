@@ -0,0 +1,8 @@
+from pydantic import BaseModel, Field
+from uuid import UUID
+from typing import List
+
+
+class StreamChange(BaseModel):
+    add: List[UUID] = Field(default_factory=list, description="Applications to start streaming")
+    remove: List[UUID] = Field(default_factory=list, description="Applications to stop streaming")
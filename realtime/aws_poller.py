@@ -4,96 +4,528 @@ from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 from database.database import Session_local
 from database.models import Application
-from metrics.aws import collect_ec2_metrics
-from metrics.aws_S3 import collect_S3_metrics
-from metrics.aws_labda import collect_lambda_metrics
 from helper.encryption import decrypt_value
+from helper.aws_clients import warm_up_clients
+from helper.aws_limits import ThrottledError
+from helper.telemetry import Gauge, Histogram
+from helper.yamlLoader import get_metrics_config, MetricsConfig, TARGET_DIMENSIONS
+from metrics.aws_discovery import DIMENSIONS, DIMENSION_DISCOVERY_WORKERS
+from realtime.planner import (
+    COLLECTORS,
+    poll_target,
+    plan_poll_cycle,
+    execute_batch,
+    target_groups
+)
+from realtime.engine import PollEngine
+from realtime.scheduler import PollScheduler
+from realtime.inventory import ApplicationInventory
+from realtime.coordination import ShardCoordinator, shard_of
+from realtime.metrics_store import create_latest_metrics_store
+from realtime.history import HistoryWriter
+from realtime.rollup import RollupEngine
+from realtime.ring_buffer import RecentSamples
+from realtime.backfill import start_backfill_thread
+from realtime.health import PollHealth
+from realtime.pubsub import MetricsHub
+from realtime.streams import StreamRegistry
+from realtime.frames import FrameCache
 
-LATEST_METRICS = {}
-POLL_INTERVAL = 30  # seconds - reduced for faster metric updates
+# Backend chosen by LATEST_METRICS_BACKEND; shared across workers unless "memory"
+LATEST_METRICS = create_latest_metrics_store()
+POLL_INTERVAL = 30  # seconds - inventory sync and shortest retry
+SCHEDULER_TICK = 5  # seconds - polls falling due within a tick share batches
+ENGINE = PollEngine()
+# Dimension discovery runs beside the poll cycles, within limits of its own
+DISCOVERY_ENGINE = PollEngine(
+    max_workers=DIMENSION_DISCOVERY_WORKERS,
+    region_concurrency=DIMENSION_DISCOVERY_WORKERS,
+    region_limits={}
+)
+DISCOVERY_JOBS = {}  # (namespace, instance) -> discovery job queued or running
+DISCOVERY_LOCK = threading.Lock()
+DISCOVERY_WAKE = threading.Event()
+SCHEDULER = PollScheduler(POLL_INTERVAL)
+TARGETS = {}  # app_id -> poll target of every scheduled application
+WATERMARKS = {}  # app_id -> {metric_key: newest datapoint timestamp stored}
+THROTTLE_DELAYS = {}  # (identity, region) -> current deferral while throttled
+INVENTORY = ApplicationInventory()
+COORDINATOR = ShardCoordinator()
+OWNED_SHARDS = frozenset()  # shards the current TARGETS were built for
+HISTORY = HistoryWriter()
+ROLLUPS = RollupEngine(history=HISTORY, resume=True)
+RECENT = RecentSamples(POLL_INTERVAL)
+HEALTH = PollHealth()
+FRAMES = FrameCache()  # serialized dashboard views, shared by all readers
+STREAMS = StreamRegistry()  # open multi-application streams, changeable from any worker
+HUB = MetricsHub(LATEST_METRICS, FRAMES, STREAMS)  # wakes the streams of updated applications
 
-def poll_all_applications():
+POLL_CYCLE_SECONDS = Histogram(
+    "poll_cycle_duration_seconds",
+    "Duration of poll cycles that had groups due",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+COLLECTOR_FETCH_SECONDS = Histogram(
+    "collector_fetch_seconds",
+    "Duration of one batch's CloudWatch fetch",
+    ("collector",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+)
+LATEST_METRICS_SIZE = Gauge(
+    "latest_metrics_entries",
+    "Applications held in LATEST_METRICS",
+    function=lambda: len(LATEST_METRICS)
+)
+
+
+def _store_error(app_id: str, app_name: str, error: Exception, collector_type: str | None = None):
+    print(f"[Poller] Error for {app_name}: {error}")
+    sample = {
+        "collector_type": collector_type,
+        "error": str(error),
+        "collected_at": datetime.now(timezone.utc).isoformat(),
+        "poll_health": HEALTH.status(app_id, time.time())
+    }
+    LATEST_METRICS[app_id] = sample
+    HUB.publish(app_id, sample)
+
+
+def _record_failure(target: dict, error: Exception, now: float):
+    """
+    Count a failed poll against the application's circuit breaker and,
+    when that opens it, hold back all of its groups until the backoff ends.
+    """
+    delay = HEALTH.record_failure(target["app_id"], error, now)
+    if delay is None:
+        return
+    for group in COLLECTORS[target["collector_type"]]["sections"]:
+        SCHEDULER.defer(target["app_id"], group, delay, now)
+    print(f"[Poller] Circuit open for {target['app_name']}, next try in {delay:.0f}s")
+
+
+def _store_latest(updated: dict):
+    """
+    Write a batch's samples to the latest metrics store. When the batch
+    write fails, each sample is written on its own, so one that cannot be
+    stored costs only its own update; those are dropped from updated.
+    """
+    try:
+        LATEST_METRICS.update(updated)
+        return
+    except Exception as e:
+        print(f"[Poller] Storing {len(updated)} samples failed, retrying one by one: {e}")
+
+    for app_id, metrics in list(updated.items()):
+        try:
+            LATEST_METRICS[app_id] = metrics
+        except Exception as e:
+            print(f"[Poller] Could not store the sample of {metrics['application_name']}: {e}")
+            del updated[app_id]
+
+
+def _store_batch(batch: dict, result: tuple):
+    """
+    Store every application's sample of a finished batch and schedule the
+    next poll of each group from the newest datapoint it returned.
+    """
+    samples, last_seen, points = result
+    now = time.time()
+    collected = datetime.now(timezone.utc)
+    collected_at = collected.isoformat()
+    config = get_metrics_config()
+    updated = {}
+    for target in batch["targets"]:
+        # Groups are polled on their own schedules, so merge into the last sample
+        previous = LATEST_METRICS.get(target["app_id"]) or {}
+        sample = samples[target["app_id"]]
+        metrics = dict(previous)
+        metrics.pop("error", None)
+        metrics.update(sample)
+        # New datapoints go to history, rollups and the ring buffer below;
+        # the shared snapshot keeps only the newest values, so it stays small
+        metrics.pop("datapoints", None)
+        metrics["collected_at"] = collected_at
+        metrics["application_id"] = target["app_id"]
+        metrics["application_name"] = target["app_name"]
+        metrics["collector_type"] = target["collector_type"]
+
+        # A metric left at None found no datapoint in its whole lookback window
+        polled = {key for app_id, key in batch["since"] if app_id == target["app_id"]}
+        empty = {key for key in polled if key in sample and sample[key] is None}
+        HEALTH.record_success(target["app_id"])
+        HEALTH.record_metrics(target["app_id"], empty, polled - empty, now)
+        metrics["poll_health"] = HEALTH.status(target["app_id"], now)
+
+        # Store by application ID
+        updated[target["app_id"]] = metrics
+        sections = COLLECTORS[target["collector_type"]]["sections"]
+        RECENT.record(
+            target["app_id"],
+            tuple(key for section in sections for key in config.keys.get(section, ())),
+            int(collected.timestamp()),
+            metrics,
+            # Its most frequently polled group sets how often rows are added
+            interval=min(
+                (config.periods[section] for section in sections if section in config.periods),
+                default=POLL_INTERVAL
+            )
+        )
+
+    _store_latest(updated)
+    HUB.publish_many(updated)
+    THROTTLE_DELAYS.pop((batch["identity"], batch["region"]), None)
+    for app_id, metric_key, timestamp, _ in points:
+        seen = WATERMARKS.setdefault(app_id, {})
+        if metric_key not in seen or timestamp > seen[metric_key]:
+            seen[metric_key] = timestamp
+    # History first: a rollup flush commits what history holds before
+    # rebuilding the buckets these points close
+    HISTORY.add(points)
+    ROLLUPS.add(points)
+
+    for (app_id, group), timestamp in last_seen.items():
+        SCHEDULER.reschedule(app_id, group, timestamp, now)
+
+    print(
+        f"[Poller] Updated metrics for {len(batch['targets'])} applications "
+        f"in {batch['region']} ({len(batch['queries'])} queries for "
+        f"{sum(len(keys) for keys in batch['query_keys'].values())} metrics)"
+    )
+
+
+def _store_batch_error(batch: dict, error: Exception):
+    """
+    A failed request marks all applications of the batch as errored and
+    counts against their circuit breakers. Their groups stay on the retry
+    schedule set when they fell due unless that opens the circuit.
+
+    A batch that stayed throttled keeps its previous samples instead, and
+    its groups are deferred by a delay that doubles while the account and
+    region keep being throttled.
+    """
+    if isinstance(error, ThrottledError):
+        key = (batch["identity"], batch["region"])
+        delay = min(THROTTLE_DELAYS.get(key, POLL_INTERVAL / 2) * 2, POLL_INTERVAL * 10)
+        THROTTLE_DELAYS[key] = delay
+        now = time.time()
+        for target in batch["targets"]:
+            for group in target_groups(target):
+                SCHEDULER.defer(target["app_id"], group, delay, now)
+        print(f"[Poller] Throttled in {batch['region']}, deferring {len(batch['targets'])} applications by {delay:.0f}s")
+        return
+
+    now = time.time()
+    for target in batch["targets"]:
+        _record_failure(target, error, now)
+        _store_error(target["app_id"], target["app_name"], error, target["collector_type"])
+
+
+def _execute_batch(batch: dict, config: MetricsConfig):
+    started = time.perf_counter()
+    try:
+        return execute_batch(batch, config)
+    finally:
+        COLLECTOR_FETCH_SECONDS.observe(
+            time.perf_counter() - started,
+            batch["targets"][0]["collector_type"]
+        )
+
+
+def _drop_batch(batch: dict):
+    """
+    A batch past its deadline keeps its previous samples.
+    """
+    print(
+        f"[Poller] Dropped {len(batch['targets'])} applications in {batch['region']}: "
+        f"no response within {ENGINE.deadline}s"
+    )
+
+
+def _build_target(row) -> dict | None:
+    """
+    Poll target of one inventory row, or None when it cannot be polled.
+    """
+    if row.cloud.lower() != "aws":
+        return None
+
+    if row.collector_type.lower() not in COLLECTORS:
+        _store_error(
+            str(row.id),
+            row.name,
+            ValueError(f"Unsupported collector type: {row.collector_type}")
+        )
+        return None
+
+    # Decrypt AWS credentials from DB if available
+    aws_access_key_id = None
+    aws_secret_access_key = None
+
+    if row.aws_access_key_id and row.aws_secret_access_key:
+        try:
+            aws_access_key_id = decrypt_value(row.aws_access_key_id)
+            aws_secret_access_key = decrypt_value(row.aws_secret_access_key)
+        except Exception as decrypt_err:
+            # Not retried until the application's row changes
+            error = ValueError(f"Failed to decrypt credentials: {decrypt_err}")
+            HEALTH.record_failure(str(row.id), error, time.time(), fatal=True)
+            _store_error(str(row.id), row.name, error, row.collector_type.lower())
+            return None
+
+    return poll_target(row, aws_access_key_id, aws_secret_access_key)
+
+
+def _unschedule(app_id: str):
+    TARGETS.pop(app_id, None)
+    WATERMARKS.pop(app_id, None)
+    SCHEDULER.remove_app(app_id)
+    ROLLUPS.forget_app(app_id)
+    RECENT.forget(app_id)
+
+
+def _refresh_targets(config: MetricsConfig):
+    """
+    Apply inventory and shard ownership changes and (un)schedule the
+    affected metric groups. Only applications in shards leased by this
+    worker are scheduled.
+    """
+    global OWNED_SHARDS
+
+    changed, removed = INVENTORY.sync()
+
+    for app_id in removed:
+        _unschedule(app_id)
+        HEALTH.forget(app_id)
+        LATEST_METRICS.pop(app_id, None)
+        FRAMES.forget(app_id)
+
+    owned = COORDINATOR.owned_shards()
+    lost, gained = OWNED_SHARDS - owned, owned - OWNED_SHARDS
+    OWNED_SHARDS = owned
+
+    if lost:
+        # The new owner keeps writing their samples; with a shared store,
+        # dropping ours here could delete its latest one
+        for app_id in [app_id for app_id in TARGETS if shard_of(app_id) in lost]:
+            _unschedule(app_id)
+            HEALTH.forget(app_id)
+            FRAMES.forget(app_id)
+    if gained:
+        changed |= {app_id for app_id in INVENTORY.rows if shard_of(app_id) in gained}
+
+    now = time.time()
+    for app_id in changed:
+        if shard_of(app_id) not in owned:
+            _unschedule(app_id)
+            continue
+
+        previous = TARGETS.get(app_id)
+        target = _build_target(INVENTORY.rows[app_id])
+        if target is None:
+            _unschedule(app_id)
+            continue
+
+        if previous is not None and previous != target:
+            # New credentials or resource: give it a fresh start right away
+            HEALTH.forget(app_id)
+            SCHEDULER.remove_app(app_id)
+        TARGETS[app_id] = target
+        for group in COLLECTORS[target["collector_type"]]["sections"]:
+            if group in config.periods:
+                SCHEDULER.add(app_id, group, config.periods[group], now)
+
+
+def _queue_discovery(targets: list, config: MetricsConfig):
     """
-    Continuously poll all active applications for metrics
+    Queue a lookup of the CWAgent dimension sets (mounts, fstypes) of
+    instances whose agent metrics are due and were not discovered within
+    the TTL. They are polled right away with the dimensions configured (or
+    found before); what discovery finds is planned from their next poll on.
+    """
+    namespaces = {metric.namespace for metric in config.groups.get("cwagent", ())}
+    now = time.time()
+    queued = 0
+    with DISCOVERY_LOCK:
+        for target in targets:
+            if "cwagent" not in target_groups(target):
+                continue
+            for namespace in namespaces:
+                key = (namespace, target["target"])
+                if key in DISCOVERY_JOBS or DIMENSIONS.is_fresh(namespace, target["target"], now):
+                    continue
+                DISCOVERY_JOBS[key] = {"region": target["region"], "namespace": namespace, "target": target}
+                queued += 1
+    if queued:
+        DISCOVERY_WAKE.set()
+
+
+def _discover_dimensions():
+    """
+    Run the queued dimension discoveries on DISCOVERY_ENGINE, off the poll cycle.
     """
-    global LATEST_METRICS
-    
     while True:
-        db: Session = Session_local()
+        DISCOVERY_WAKE.wait()
+        DISCOVERY_WAKE.clear()
+        with DISCOVERY_LOCK:
+            jobs = list(DISCOVERY_JOBS.values())
         try:
-            # Get all active applications
-            applications = db.query(Application).filter(
-                Application.is_active.is_(True)
-            ).all()
-            
-            for app in applications:
-                if app.cloud.lower() == "aws":
-                    try:
-                        # Decrypt AWS credentials from DB if available
-                        aws_access_key_id = None
-                        aws_secret_access_key = None
-                        
-                        if app.aws_access_key_id and app.aws_secret_access_key:
-                            try:
-                                aws_access_key_id = decrypt_value(app.aws_access_key_id)
-                                aws_secret_access_key = decrypt_value(app.aws_secret_access_key)
-                            except Exception as decrypt_err:
-                                print(f"[Poller] Failed to decrypt credentials for {app.name}: {decrypt_err}")
-                                continue
-                        
-                        if app.collector_type.lower() == "ec2":
-                            metrics = collect_ec2_metrics(
-                                instance_id=app.instance_id,
-                                region=app.region,
-                                agent_installed=True,
-                                aws_access_key_id=aws_access_key_id,
-                                aws_secret_access_key=aws_secret_access_key
-                            )
-                        elif app.collector_type.lower() == "s3":
-                            metrics = collect_S3_metrics(
-                            bucket_name=app.bucket_name,
-                            region=app.region,
-                            aws_access_key_id=aws_access_key_id,
-                            aws_secret_access_key=aws_secret_access_key
-                        )
-                        elif app.collector_type.lower() == "lambda":
-                            metrics = collect_lambda_metrics(
-                                function_name=app.function_name,
-                                region=app.region,
-                                aws_access_key_id=aws_access_key_id,
-                                aws_secret_access_key=aws_secret_access_key
-                            )
-                        metrics["collected_at"] = datetime.now(timezone.utc).isoformat()
-                        metrics["application_id"] = str(app.id)
-                        metrics["application_name"] = app.name
-                        
-                        # Store by application ID
-                        LATEST_METRICS[str(app.id)] = metrics
-                        if app.collector_type.lower() == "ec2":
-                            print(f"[Poller] Updated metrics for {app.name} ({app.instance_id})")
-                        elif app.collector_type.lower() == "s3":
-                            print(f"[Poller] Updated metrics for {app.name} ({app.bucket_name})")
-
-                    except Exception as e:
-                        print(f"[Poller] Error for {app.name}: {e}")
-                        LATEST_METRICS[str(app.id)] = {
-                            "error": str(e),
-                            "collected_at": datetime.now(timezone.utc).isoformat()
-                        }
-        
+            DISCOVERY_ENGINE.run_cycle(
+                jobs,
+                work=lambda job: DIMENSIONS.refresh(
+                    job["region"],
+                    job["namespace"],
+                    TARGET_DIMENSIONS["cwagent"],
+                    job["target"]["target"],
+                    job["target"]["aws_access_key_id"],
+                    job["target"]["aws_secret_access_key"]
+                ),
+                on_result=lambda job, metrics: None,
+                on_error=lambda job, error: print(
+                    f"[Poller] Dimension discovery failed for {job['target']['app_name']}: {error}"
+                ),
+                on_timeout=lambda job: print(
+                    f"[Poller] Dimension discovery timed out for {job['target']['app_name']}"
+                )
+            )
+            print(f"[Poller] Refreshed agent dimensions for {len(jobs)} instances")
         except Exception as e:
-            print(f"[Poller] Database error: {e}")
-        
+            print(f"[Poller] Dimension discovery error: {e}")
         finally:
-            db.close()
-        
-        time.sleep(POLL_INTERVAL)
+            # Ones that did not finish are queued again when next due
+            with DISCOVERY_LOCK:
+                for job in jobs:
+                    DISCOVERY_JOBS.pop((job["namespace"], job["target"]["target"]), None)
+
+
+def _poll_due(due: list, config: MetricsConfig) -> dict:
+    """
+    Plan and run the groups that fell due.
+    """
+    # Leases that lapsed since the last refresh stop polling at once
+    owned = COORDINATOR.owned_shards()
+    now = time.time()
+    groups_by_app = {}
+    for app_id, group in due:
+        if shard_of(app_id) not in owned:
+            continue
+        open_until = HEALTH.open_until(app_id, now)
+        if open_until is not None:
+            SCHEDULER.defer(app_id, group, open_until - now, now)
+            continue
+        groups_by_app.setdefault(app_id, []).append(group)
+
+    # Metrics that keep coming back empty are left out until their backoff ends
+    targets = [
+        dict(TARGETS[app_id], groups=tuple(groups), skip=HEALTH.skipped_metrics(app_id, now))
+        for app_id, groups in groups_by_app.items()
+        if app_id in TARGETS
+    ]
+    _queue_discovery(targets, config)
+
+    # Applications sharing a region and key pair share requests
+    return ENGINE.run_cycle(
+        plan_poll_cycle(targets, config, WATERMARKS),
+        work=lambda batch: _execute_batch(batch, config),
+        on_result=_store_batch,
+        on_error=_store_batch_error,
+        on_timeout=_drop_batch
+    )
+
+
+def poll_all_applications():
+    """
+    Continuously poll active applications as their metric groups fall due
+    """
+    next_refresh = 0.0
+
+    while True:
+        cycle_started = time.monotonic()
+        stats = {}
+        try:
+            config = get_metrics_config()
+
+            if time.time() >= next_refresh:
+                try:
+                    _refresh_targets(config)
+                    next_refresh = time.time() + POLL_INTERVAL
+                except Exception as e:
+                    print(f"[Poller] Database error: {e}")
+
+            due = SCHEDULER.pop_due(time.time())
+            if due:
+                stats = _poll_due(due, config)
+                stats["due"] = len(due)
+
+        except Exception as e:
+            print(f"[Poller] Cycle error: {e}")
+
+        if stats:
+            duration = time.monotonic() - cycle_started
+            POLL_CYCLE_SECONDS.observe(duration)
+            print(
+                f"[Poller] Cycle took {duration:.2f}s of {POLL_INTERVAL}s budget "
+                f"({stats['due']} groups due, {stats['completed']} batches ok, "
+                f"{stats['failed']} failed, {stats['dropped']} dropped)"
+            )
+            if duration > POLL_INTERVAL:
+                print(f"[Poller] Cycle overran its budget by {duration - POLL_INTERVAL:.2f}s")
+
+        next_wake = min(SCHEDULER.next_due() or next_refresh, next_refresh)
+        time.sleep(max(SCHEDULER_TICK, next_wake - time.time()))
+
+
+def warm_up_aws_clients():
+    """
+    Build a CloudWatch client for every active (region, key pair) so the
+    first poll cycle does not pay for client construction.
+    """
+    db: Session = Session_local()
+    try:
+        rows = db.query(
+            Application.region,
+            Application.aws_access_key_id,
+            Application.aws_secret_access_key
+        ).filter(
+            Application.is_active.is_(True)
+        ).all()
+    finally:
+        db.close()
+
+    entries = set()
+    for region, encrypted_key_id, encrypted_secret in rows:
+        try:
+            entries.add((
+                "cloudwatch",
+                region,
+                decrypt_value(encrypted_key_id) or None,
+                decrypt_value(encrypted_secret) or None
+            ))
+        except ValueError:
+            continue
+
+    count = warm_up_clients(entries)
+    print(f"[Poller] Warmed up {count} CloudWatch clients")
 
 
 def start_poller_thread():
     """
     Start the poller in a background thread
     """
+    COORDINATOR.start()
+    HISTORY.start()
+    ROLLUPS.start()
+    start_backfill_thread()
+    threading.Thread(target=_discover_dimensions, daemon=True).start()
     thread = threading.Thread(target=poll_all_applications, daemon=True)
     thread.start()
     print("[Poller] Background metrics collector started")
+
+
+def stop_poller():
+    """
+    Release this worker's shard leases so the remaining workers take over
+    its applications without waiting for the leases to expire, and write
+    out the history and rollup buckets still buffered.
+    """
+    COORDINATOR.stop()
+    HISTORY.stop()
+    ROLLUPS.stop()
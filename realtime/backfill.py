@@ -0,0 +1,282 @@
+import os
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import Application, BackfillJob, MetricSample
+from helper.encryption import decrypt_value
+from helper.yamlLoader import get_metrics_config
+from metrics.aws_batch_fetcher import build_metric_queries, fetch_metric_data
+from realtime.planner import COLLECTORS, poll_target
+from realtime.history import insert_samples, HISTORY_RETENTION_DAYS
+from realtime.rollup import RollupEngine, upsert_rollups
+
+# Days loaded for applications created through the API; 0 turns it off
+BACKFILL_ON_CREATE_DAYS = int(os.getenv("BACKFILL_ON_CREATE_DAYS", "0"))
+# GetMetricData calls per second for all backfills of one process, leaving
+# the rest of the account's quota to the live poller
+BACKFILL_REQUESTS_PER_SECOND = float(os.getenv("BACKFILL_REQUESTS_PER_SECOND", "1"))
+BACKFILL_CHECK_INTERVAL = 30  # seconds between looks for queued jobs
+# A running job not updated for this long belongs to a crashed worker
+BACKFILL_STALE_AFTER = timedelta(minutes=10)
+
+# CloudWatch keeps coarser datapoints as they age: 1 minute for 15 days,
+# 5 minutes for 63 days, 1 hour for 15 months
+RETENTION_TIERS = (
+    (timedelta(days=15), 60),
+    (timedelta(days=63), 300),
+    (timedelta(days=455), 3600),
+)
+
+
+def tier_period(age: timedelta) -> int:
+    """
+    Finest period CloudWatch still holds for datapoints of this age.
+    """
+    for max_age, period in RETENTION_TIERS:
+        if age <= max_age:
+            return period
+    return RETENTION_TIERS[-1][1]
+
+
+class _Pacer:
+    """
+    Spaces calls at least 1/rate seconds apart across threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+PACER = _Pacer(BACKFILL_REQUESTS_PER_SECOND)
+
+
+def queue_backfill(db: Session, app_id, days: int, status: str = "pending"):
+    """
+    Queue (or restart) a backfill of the last `days` days; db is committed by
+    the caller. A job created as "running" is left alone by the background worker.
+    """
+    db.execute(
+        insert(BackfillJob)
+        .values(application_id=app_id, status=status, days=days)
+        .on_conflict_do_update(
+            index_elements=["application_id"],
+            set_={
+                "status": status,
+                "days": days,
+                "start_time": None,
+                "end_time": None,
+                "cursor": None,
+                "error": None,
+                "updated_at": func.now(),
+            }
+        )
+    )
+
+
+def _plan_window(db: Session, job: BackfillJob, lookback: timedelta):
+    """
+    Fix the job's time range on its first run. It ends where the live
+    poller's data begins so no datapoint is counted twice in the rollups.
+    """
+    now = datetime.now(timezone.utc)
+    days = job.days
+    if days > HISTORY_RETENTION_DAYS:
+        print(f"[Backfill] Limiting {days} days to the {HISTORY_RETENTION_DAYS} days of history retention")
+        days = HISTORY_RETENTION_DAYS
+
+    end = now - lookback
+    first_sample = db.execute(
+        select(func.min(MetricSample.ts)).where(MetricSample.application_id == job.application_id)
+    ).scalar()
+    if first_sample is not None and first_sample < end:
+        end = first_sample
+
+    job.end_time = end
+    job.start_time = now - timedelta(days=days)
+    job.cursor = end
+
+
+def _chunk_start(cursor: datetime, start: datetime) -> datetime:
+    # UTC day boundaries, so every rollup bucket falls inside one chunk
+    midnight = cursor.replace(hour=0, minute=0, second=0, microsecond=0)
+    if midnight == cursor:
+        midnight -= timedelta(days=1)
+    return max(midnight, start)
+
+
+def _fetch_chunk(target: dict, specs: list, chunk_start: datetime, chunk_end: datetime) -> list:
+    period = tier_period(datetime.now(timezone.utc) - chunk_start)
+    queries, query_keys = build_metric_queries(
+        [dict(spec, period=max(spec["period"], period)) for spec in specs]
+    )
+    if not queries:
+        return []
+
+    datapoints = fetch_metric_data(
+        region=target["region"],
+        queries=queries,
+        start_time=chunk_start,
+        end_time=chunk_end,
+        aws_access_key_id=target["aws_access_key_id"],
+        aws_secret_access_key=target["aws_secret_access_key"],
+        before_request=PACER.wait
+    )
+
+    points = []
+    for query_id, keys in query_keys.items():
+        for timestamp, value in datapoints.get(query_id, ()):
+            if not chunk_start <= timestamp < chunk_end:
+                continue
+            points.extend((target["app_id"], key, timestamp, value) for key in keys)
+    points.sort(key=lambda point: point[2])
+    return points
+
+
+def run_backfill(app_id) -> bool:
+    """
+    Load an application's CloudWatch history, newest day first, committing
+    the samples, their rollups and the job cursor together after every day.
+    Returns True when the job is finished.
+    """
+    db: Session = Session_local()
+    try:
+        job = db.get(BackfillJob, app_id)
+        application = db.get(Application, app_id)
+        if job is None:
+            return False
+        if application is None or not application.is_active:
+            job.status = "done"
+            db.commit()
+            return True
+
+        collector = COLLECTORS.get(application.collector_type.lower())
+        if collector is None or application.cloud.lower() != "aws":
+            job.status = "failed"
+            job.error = f"Unsupported collector type: {application.collector_type}"
+            db.commit()
+            return True
+
+        target = poll_target(
+            application,
+            decrypt_value(application.aws_access_key_id) or None,
+            decrypt_value(application.aws_secret_access_key) or None
+        )
+        specs = collector["build_specs"](get_metrics_config(), target["target"])
+
+        job.status = "running"
+        if job.cursor is None:
+            _plan_window(db, job, collector["lookback"])
+        db.commit()
+
+        loaded = 0
+        while job.cursor > job.start_time:
+            chunk_start = _chunk_start(job.cursor, job.start_time)
+            points = _fetch_chunk(target, specs, chunk_start, job.cursor)
+
+            rollups = RollupEngine()
+            rollups.add(points)
+            insert_samples(db, points)
+            upsert_rollups(db, rollups.take_closed(close_all=True))
+            job.cursor = chunk_start
+            db.commit()
+
+            loaded += len(points)
+            print(f"[Backfill] {application.name}: {loaded} datapoints loaded back to {chunk_start.date()}")
+
+        job.status = "done"
+        db.commit()
+        return True
+
+    except Exception as e:
+        db.rollback()
+        print(f"[Backfill] Failed for {app_id}: {e}")
+        job = db.get(BackfillJob, app_id)
+        if job is not None:
+            job.status = "failed"
+            job.error = str(e)
+            db.commit()
+        return False
+    finally:
+        db.close()
+
+
+def _claim_job():
+    """
+    Take one queued job, or one whose worker stopped updating it.
+    """
+    db: Session = Session_local()
+    try:
+        app_id = db.execute(
+            select(BackfillJob.application_id)
+            .where(or_(
+                BackfillJob.status == "pending",
+                (BackfillJob.status == "running") & (BackfillJob.updated_at < func.now() - BACKFILL_STALE_AFTER)
+            ))
+            .order_by(BackfillJob.updated_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if app_id is not None:
+            db.get(BackfillJob, app_id).status = "running"
+            db.commit()
+        return app_id
+    finally:
+        db.close()
+
+
+def _run_queued():
+    while True:
+        try:
+            app_id = _claim_job()
+            if app_id is not None:
+                run_backfill(app_id)
+                continue
+        except Exception as e:
+            print(f"[Backfill] Database error: {e}")
+        time.sleep(BACKFILL_CHECK_INTERVAL)
+
+
+def start_backfill_thread():
+    """
+    Work through queued backfill jobs in the background, one at a time.
+    """
+    thread = threading.Thread(target=_run_queued, daemon=True)
+    thread.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load CloudWatch history for an application")
+    parser.add_argument("application_id")
+    parser.add_argument("--days", type=int, default=HISTORY_RETENTION_DAYS)
+    parser.add_argument("--restart", action="store_true", help="start over instead of resuming")
+    args = parser.parse_args()
+    app_id = uuid.UUID(args.application_id)
+
+    db: Session = Session_local()
+    try:
+        job = db.get(BackfillJob, app_id)
+        if job is None or args.restart or job.status == "done":
+            queue_backfill(db, app_id, args.days, status="running")
+        else:
+            job.status = "running"
+        db.commit()
+    finally:
+        db.close()
+
+    raise SystemExit(0 if run_backfill(app_id) else 1)
@@ -0,0 +1,181 @@
+import os
+import math
+import time
+import uuid
+import zlib
+import socket
+import threading
+from datetime import timedelta
+from sqlalchemy import select, update, delete, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import PollerWorker, PollerShard
+
+# Applications are hashed into a fixed number of shards; shards are the
+# unit that moves between workers
+POLL_SHARDS = int(os.getenv("POLL_SHARDS", "64"))
+HEARTBEAT_INTERVAL = float(os.getenv("POLL_HEARTBEAT_INTERVAL", "10"))  # seconds
+LEASE_TTL = float(os.getenv("POLL_LEASE_TTL", "30"))  # seconds
+
+
+def shard_of(app_id: str) -> int:
+    """
+    Stable shard of an application id, identical in every process.
+    """
+    return zlib.crc32(str(app_id).encode()) % POLL_SHARDS
+
+
+class ShardCoordinator:
+    """
+    Splits the shards among the live poller workers through lease rows in
+    Postgres, so every application is polled by exactly one worker.
+
+    On every heartbeat a worker renews its own leases, works out its fair
+    share (shards / live workers, rounded up), releases shards above that
+    share and claims free or expired ones below it with SKIP LOCKED. When a
+    worker joins, the others shed shards on their next heartbeat and it picks
+    them up. When a worker dies, its leases expire and are claimed by the rest.
+    """
+
+    def __init__(self, shards: int = POLL_SHARDS):
+        self.shards = shards
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._owned = frozenset()
+        self._renewed_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def owned_shards(self) -> frozenset:
+        """
+        Shards this worker may poll. Empty once the leases may have lapsed
+        because heartbeats stopped reaching the database.
+        """
+        if time.monotonic() - self._renewed_at > LEASE_TTL - HEARTBEAT_INTERVAL:
+            return frozenset()
+        return self._owned
+
+    def _ensure_shards(self, db: Session):
+        db.execute(
+            insert(PollerShard)
+            .values([{"shard_id": shard_id} for shard_id in range(self.shards)])
+            .on_conflict_do_nothing(index_elements=["shard_id"])
+        )
+
+    def heartbeat(self):
+        """
+        Renew, release and claim leases; one short transaction.
+        """
+        lease_until = func.now() + timedelta(seconds=LEASE_TTL)
+        db: Session = Session_local()
+        try:
+            db.execute(
+                insert(PollerWorker)
+                .values(worker_id=self.worker_id)
+                .on_conflict_do_update(
+                    index_elements=["worker_id"],
+                    set_={"heartbeat_at": func.now()}
+                )
+            )
+            db.execute(
+                delete(PollerWorker)
+                .where(PollerWorker.heartbeat_at < func.now() - timedelta(seconds=LEASE_TTL))
+            )
+
+            live_workers = db.execute(select(func.count()).select_from(PollerWorker)).scalar() or 1
+            fair_share = math.ceil(self.shards / live_workers)
+
+            owned = sorted(db.execute(
+                update(PollerShard)
+                .where(PollerShard.owner == self.worker_id, PollerShard.shard_id < self.shards)
+                .values(lease_expires_at=lease_until)
+                .returning(PollerShard.shard_id)
+            ).scalars())
+
+            if len(owned) > fair_share:
+                db.execute(
+                    update(PollerShard)
+                    .where(PollerShard.shard_id.in_(owned[fair_share:]))
+                    .values(owner=None, lease_expires_at=None)
+                )
+                owned = owned[:fair_share]
+
+            elif len(owned) < fair_share:
+                claimable = db.execute(
+                    select(PollerShard.shard_id)
+                    .where(
+                        PollerShard.shard_id < self.shards,
+                        or_(
+                            PollerShard.owner.is_(None),
+                            PollerShard.lease_expires_at < func.now()
+                        )
+                    )
+                    .order_by(PollerShard.shard_id)
+                    .limit(fair_share - len(owned))
+                    .with_for_update(skip_locked=True)
+                ).scalars().all()
+                if claimable:
+                    db.execute(
+                        update(PollerShard)
+                        .where(PollerShard.shard_id.in_(claimable))
+                        .values(owner=self.worker_id, lease_expires_at=lease_until)
+                    )
+                    owned.extend(claimable)
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        if set(owned) != self._owned:
+            print(f"[Coordinator] {self.worker_id} owns {len(owned)}/{self.shards} shards ({live_workers} workers)")
+        self._owned = frozenset(owned)
+        self._renewed_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"[Coordinator] Heartbeat failed: {e}")
+
+    def start(self):
+        """
+        Register this worker, take a first share and keep heartbeating.
+        """
+        db: Session = Session_local()
+        try:
+            self._ensure_shards(db)
+            db.commit()
+        finally:
+            db.close()
+
+        try:
+            self.heartbeat()
+        except Exception as e:
+            print(f"[Coordinator] Initial heartbeat failed: {e}")
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Hand every lease back so other workers can claim it at once.
+        """
+        self._stop.set()
+        db: Session = Session_local()
+        try:
+            db.execute(
+                update(PollerShard)
+                .where(PollerShard.owner == self.worker_id)
+                .values(owner=None, lease_expires_at=None)
+            )
+            db.execute(delete(PollerWorker).where(PollerWorker.worker_id == self.worker_id))
+            db.commit()
+        except Exception as e:
+            print(f"[Coordinator] Failed to release leases: {e}")
+        finally:
+            db.close()
+        self._owned = frozenset()
@@ -0,0 +1,157 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Upper bound on CloudWatch requests in flight across all regions
+POLL_MAX_WORKERS = int(os.getenv("POLL_MAX_WORKERS", "16"))
+# Default and per-region caps, e.g. POLL_REGION_LIMITS="us-east-1=8,eu-west-1=2"
+POLL_REGION_CONCURRENCY = int(os.getenv("POLL_REGION_CONCURRENCY", "4"))
+POLL_REGION_LIMITS = os.getenv("POLL_REGION_LIMITS", "")
+# A batch still running after this many seconds is dropped from the cycle
+POLL_BATCH_DEADLINE = float(os.getenv("POLL_BATCH_DEADLINE", "20"))
+
+
+def parse_region_limits(value: str) -> dict:
+    """
+    Parse "region=limit,region=limit" into a dict.
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        region, limit = item.split("=", 1)
+        limits[region.strip()] = int(limit)
+    return limits
+
+
+def _check_limit(name: str, limit: int):
+    # A limit below 1 would never let a batch through
+    if limit < 1:
+        raise ValueError(f"{name} must be at least 1, got {limit}")
+
+
+class PollEngine:
+    """
+    Runs planned batches on a thread pool with a global concurrency limit,
+    per-region limits and a deadline per batch.
+
+    Python threads cannot be cancelled, so a batch that misses its deadline
+    is abandoned: its result is discarded, but its thread keeps counting
+    against the limits until the call really returns. That keeps a hung
+    region from piling up threads while the rest of the cycle moves on.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = POLL_MAX_WORKERS,
+        region_concurrency: int = POLL_REGION_CONCURRENCY,
+        region_limits: dict | None = None,
+        deadline: float = POLL_BATCH_DEADLINE
+    ):
+        self.max_workers = max_workers
+        self.region_concurrency = region_concurrency
+        self.region_limits = (
+            region_limits if region_limits is not None
+            else parse_region_limits(POLL_REGION_LIMITS)
+        )
+        _check_limit("Worker limit", max_workers)
+        _check_limit("Region concurrency", region_concurrency)
+        for region, limit in self.region_limits.items():
+            _check_limit(f"Limit of region {region}", limit)
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="poll-worker"
+        )
+        self._running = {}  # future -> region, including abandoned calls
+        self._region_load = {}
+
+    def _limit_for(self, region: str) -> int:
+        return self.region_limits.get(region, self.region_concurrency)
+
+    def _release(self, future):
+        region = self._running.pop(future, None)
+        if region is not None:
+            self._region_load[region] -= 1
+
+    def _reap_abandoned(self, active: dict):
+        for future in [f for f in self._running if f.done() and f not in active]:
+            self._release(future)
+
+    @staticmethod
+    def _callback(callback, batch: dict, *args):
+        """
+        Run a result callback; one failing does not cost the cycle the
+        other batches.
+        """
+        try:
+            callback(batch, *args)
+        except Exception as e:
+            print(f"[Engine] {callback.__name__} failed for a {batch.get('region')} batch: {e}")
+
+    def run_cycle(self, batches: list, work, on_result, on_error, on_timeout) -> dict:
+        """
+        Run work(batch) for every batch and report each outcome through
+        on_result(batch, result), on_error(batch, exc) or on_timeout(batch).
+        Returns counters for the cycle.
+        """
+        pending = {}
+        for batch in batches:
+            pending.setdefault(batch["region"], deque()).append(batch)
+
+        active = {}  # future -> (batch, deadline)
+        stats = {"batches": len(batches), "completed": 0, "failed": 0, "dropped": 0}
+
+        while pending or active:
+            self._reap_abandoned(active)
+
+            # ---------------- DISPATCH ----------------
+            for region in list(pending):
+                queue = pending[region]
+                while (
+                    queue
+                    and len(self._running) < self.max_workers
+                    and self._region_load.get(region, 0) < self._limit_for(region)
+                ):
+                    batch = queue.popleft()
+                    future = self._executor.submit(work, batch)
+                    self._running[future] = region
+                    self._region_load[region] = self._region_load.get(region, 0) + 1
+                    active[future] = (batch, time.monotonic() + self.deadline)
+                if not queue:
+                    del pending[region]
+
+            if not active:
+                # Every free slot is held by an abandoned call; wait for one
+                wait(list(self._running), timeout=1.0, return_when=FIRST_COMPLETED)
+                continue
+
+            # ---------------- COLLECT ----------------
+            next_deadline = min(deadline for _, deadline in active.values())
+            done, _ = wait(
+                list(active),
+                timeout=max(0.0, next_deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED
+            )
+
+            for future in done:
+                batch, _ = active.pop(future)
+                self._release(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    self._callback(on_error, batch, e)
+                else:
+                    stats["completed"] += 1
+                    self._callback(on_result, batch, result)
+
+            now = time.monotonic()
+            for future, (batch, deadline) in list(active.items()):
+                if now >= deadline:
+                    del active[future]
+                    stats["dropped"] += 1
+                    self._callback(on_timeout, batch)
+
+        return stats
@@ -0,0 +1,108 @@
+import json
+import threading
+from typing import NamedTuple, Optional
+from realtime.planner import COLLECTORS
+
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+
+class Frame(NamedTuple):
+    version: int
+    token: Optional[str]  # collected_at of the sample
+    formatted: dict
+    payload: bytes  # formatted, as JSON
+    metrics: bytes  # the whole sample, as JSON
+    data: bytes  # ready SSE event
+    tagged: bytes  # ready SSE event naming the application, for /metrics/stream
+    changes: str  # formatted fields that differ from the previous version, as JSON
+
+    def snapshot(self, app_id: str, extra: Optional[dict] = None) -> bytes:
+        """
+        JSON body of the snapshot endpoint, built around the cached bytes.
+        """
+        parts = [
+            b'{"application_id":', json.dumps(app_id).encode(),
+            b',"timestamp":', json.dumps(self.token).encode(),
+            b',"metrics":', self.metrics,
+            b',"formatted":', self.payload,
+        ]
+        for key, value in (extra or {}).items():
+            parts += [b",", json.dumps(key).encode(), b":", json.dumps(value).encode()]
+        parts.append(b"}")
+        return b"".join(parts)
+
+
+def collector_of(sample: dict) -> str:
+    """
+    Collector type of a stored sample; older samples did not record it.
+    """
+    collector_type = sample.get("collector_type")
+    if collector_type in COLLECTORS:
+        return collector_type
+    for name, collector in COLLECTORS.items():
+        if collector["target_field"] in sample:
+            return name
+    return "ec2"
+
+
+def changed_fields(previous: dict, formatted: dict) -> dict:
+    """
+    Fields of formatted that are new or differ from previous; removed ones
+    are given as None.
+    """
+    changes = {key: value for key, value in formatted.items() if key not in previous or previous[key] != value}
+    for key in previous.keys() - formatted.keys():
+        changes[key] = None
+    return changes
+
+
+class FrameCache:
+    """
+    The formatted view and serialized bytes of each application's newest
+    sample, built once per sample however many streams and snapshot
+    requests read it. Versions count the samples seen per application and
+    double as SSE event ids.
+    """
+
+    def __init__(self):
+        self._frames = {}  # app_id -> Frame
+        self._lock = threading.Lock()
+
+    def get(self, app_id: str, sample: dict) -> Frame:
+        """
+        Frame of the sample, or the cached one when the sample is not newer.
+        """
+        token = sample.get("collected_at")
+        cached = self._frames.get(app_id)
+        # ISO timestamps in UTC compare in time order
+        if cached is not None and (token or "") <= (cached.token or ""):
+            return cached
+
+        formatted = COLLECTORS[collector_of(sample)]["format"](sample)
+        payload = json.dumps(formatted).encode()
+        metrics = json.dumps(sample).encode()
+
+        with self._lock:
+            cached = self._frames.get(app_id)
+            if cached is not None and (token or "") <= (cached.token or ""):
+                return cached
+            version = cached.version + 1 if cached is not None else 1
+            previous = cached.formatted if cached is not None else {}
+            frame = Frame(
+                version=version,
+                token=token,
+                formatted=formatted,
+                payload=payload,
+                metrics=metrics,
+                data=b"id: %d\ndata: %s\n\n" % (version, payload),
+                tagged=b'event: metrics\ndata: {"application_id":%s,"version":%d,"data":%s}\n\n' % (
+                    json.dumps(app_id).encode(), version, payload
+                ),
+                changes=json.dumps(changed_fields(previous, formatted))
+            )
+            self._frames[app_id] = frame
+            return frame
+
+    def forget(self, app_id: str):
+        with self._lock:
+            self._frames.pop(app_id, None)
@@ -0,0 +1,164 @@
+import os
+import threading
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError, NoCredentialsError
+
+# Consecutive failed polls that open an application's circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_BASE_BACKOFF = float(os.getenv("CIRCUIT_BASE_BACKOFF", "60"))  # seconds
+CIRCUIT_MAX_BACKOFF = float(os.getenv("CIRCUIT_MAX_BACKOFF", "3600"))  # seconds
+# Polls in a row without any datapoint before a metric is skipped
+EMPTY_RESULT_THRESHOLD = int(os.getenv("EMPTY_RESULT_THRESHOLD", "3"))
+EMPTY_RESULT_BASE_BACKOFF = float(os.getenv("EMPTY_RESULT_BASE_BACKOFF", "300"))  # seconds
+EMPTY_RESULT_MAX_BACKOFF = float(os.getenv("EMPTY_RESULT_MAX_BACKOFF", "21600"))  # seconds
+
+# Errors retrying cannot fix; they open the circuit at once
+FATAL_ERROR_CODES = {
+    "AccessDenied",
+    "AccessDeniedException",
+    "AuthFailure",
+    "ExpiredToken",
+    "ExpiredTokenException",
+    "InvalidAccessKeyId",
+    "InvalidClientTokenId",
+    "OptInRequired",
+    "SignatureDoesNotMatch",
+    "UnrecognizedClientException",
+}
+
+
+def is_fatal(error: Exception) -> bool:
+    if isinstance(error, NoCredentialsError):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in FATAL_ERROR_CODES
+    return False
+
+
+def _backoff(base: float, limit: float, step: int) -> float:
+    return min(base * 2 ** step, limit)
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class PollHealth:
+    """
+    Per-application circuit breakers and per-metric empty-result caches.
+
+    An application whose polls fail CIRCUIT_FAILURE_THRESHOLD times in a row
+    (or once with an error such as AccessDenied) is not polled again until
+    its backoff passes; the next poll is a probe that closes the circuit on
+    success or reopens it for twice as long.
+
+    A metric that returns no datapoint EMPTY_RESULT_THRESHOLD polls in a row
+    is left out of the queries for a backoff that doubles with every
+    further empty probe, and is queried normally again once it has data.
+    """
+
+    def __init__(self):
+        self._circuits = {}  # app_id -> {"failures", "opens", "open_until", "error"}
+        self._empty = {}  # app_id -> {metric_key: {"polls", "retry_at"}}
+        self._lock = threading.Lock()
+
+    # ---------------- Circuit breakers ----------------
+
+    def record_success(self, app_id: str):
+        with self._lock:
+            self._circuits.pop(app_id, None)
+
+    def record_failure(self, app_id: str, error: Exception, now: float, fatal: bool = False):
+        """
+        Count a failed poll. Returns the seconds until the next poll when
+        this opens the circuit, or None while it stays closed.
+        """
+        with self._lock:
+            circuit = self._circuits.setdefault(
+                app_id, {"failures": 0, "opens": 0, "open_until": None, "error": None}
+            )
+            circuit["failures"] += 1
+            circuit["error"] = str(error)
+            if circuit["failures"] < CIRCUIT_FAILURE_THRESHOLD and not (fatal or is_fatal(error)):
+                return None
+
+            delay = _backoff(CIRCUIT_BASE_BACKOFF, CIRCUIT_MAX_BACKOFF, circuit["opens"])
+            circuit["opens"] += 1
+            circuit["open_until"] = now + delay
+            return delay
+
+    def open_until(self, app_id: str, now: float):
+        """
+        End of the application's backoff while it is in the future, else None.
+        """
+        circuit = self._circuits.get(app_id)
+        if circuit is None or circuit["open_until"] is None or circuit["open_until"] <= now:
+            return None
+        return circuit["open_until"]
+
+    # ---------------- Empty results ----------------
+
+    def record_metrics(self, app_id: str, empty: set, found: set, now: float):
+        """
+        Update the empty-result cache from one poll of an application.
+        """
+        with self._lock:
+            metrics = self._empty.setdefault(app_id, {})
+            for metric_key in found:
+                metrics.pop(metric_key, None)
+            for metric_key in empty:
+                entry = metrics.setdefault(metric_key, {"polls": 0, "retry_at": None})
+                entry["polls"] += 1
+                skipped = entry["polls"] - EMPTY_RESULT_THRESHOLD
+                if skipped >= 0:
+                    entry["retry_at"] = now + _backoff(
+                        EMPTY_RESULT_BASE_BACKOFF, EMPTY_RESULT_MAX_BACKOFF, skipped
+                    )
+            if not metrics:
+                del self._empty[app_id]
+
+    def skipped_metrics(self, app_id: str, now: float) -> frozenset:
+        """
+        Metrics of the application to leave out of its next queries.
+        """
+        with self._lock:
+            return frozenset(
+                metric_key
+                for metric_key, entry in self._empty.get(app_id, {}).items()
+                if entry["retry_at"] is not None and entry["retry_at"] > now
+            )
+
+    # ---------------- Reporting ----------------
+
+    def forget(self, app_id: str):
+        with self._lock:
+            self._circuits.pop(app_id, None)
+            self._empty.pop(app_id, None)
+
+    def status(self, app_id: str, now: float) -> dict:
+        """
+        JSON-ready breaker and empty-metric state of an application.
+        """
+        with self._lock:
+            circuit = self._circuits.get(app_id)
+            if circuit is None or circuit["open_until"] is None:
+                state = "closed"
+            elif circuit["open_until"] > now:
+                state = "open"
+            else:
+                state = "half_open"
+
+            return {
+                "circuit": state,
+                "failures": circuit["failures"] if circuit else 0,
+                "retry_at": _iso(circuit["open_until"]) if state == "open" else None,
+                "last_error": circuit["error"] if circuit else None,
+                "empty_metrics": {
+                    metric_key: {
+                        "empty_polls": entry["polls"],
+                        "retry_at": _iso(entry["retry_at"]) if entry["retry_at"] else None,
+                    }
+                    for metric_key, entry in self._empty.get(app_id, {}).items()
+                    if entry["retry_at"] is not None
+                },
+            }
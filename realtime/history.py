@@ -0,0 +1,212 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, date, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import MetricSample
+
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "5"))  # seconds
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "5000"))  # rows per flush
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HISTORY_RETENTION_CHECK_INTERVAL = 3600  # seconds
+HISTORY_MAX_BUFFER = 500_000  # rows kept while the database is unreachable
+HISTORY_MAX_POINTS = 10_000  # per series in one range query
+
+# 4 parameters per row stay well under Postgres' 65535 bind parameters
+_INSERT_CHUNK = 2000
+_PARTITION_PREFIX = "metric_samples_"
+
+
+def _partition_name(day: date) -> str:
+    return f"{_PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def ensure_partitions(db: Session, days):
+    """
+    Create the daily partitions covering the given days if missing.
+    """
+    for day in sorted(set(days)):
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS observability.{_partition_name(day)} "
+            f"PARTITION OF observability.metric_samples "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        ))
+
+
+def drop_expired_partitions(db: Session, retention_days: int = HISTORY_RETENTION_DAYS) -> list:
+    """
+    Drop the daily partitions entirely older than the retention window.
+    """
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    partitions = db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_namespace ns ON ns.oid = parent.relnamespace "
+        "WHERE ns.nspname = 'observability' AND parent.relname = 'metric_samples'"
+    )).scalars().all()
+
+    dropped = []
+    for name in partitions:
+        try:
+            day = datetime.strptime(name[len(_PARTITION_PREFIX):], "%Y%m%d").date()
+        except ValueError:
+            continue
+        if day < cutoff:
+            db.execute(text(f"DROP TABLE IF EXISTS observability.{name}"))
+            dropped.append(name)
+    return dropped
+
+
+def insert_samples(db: Session, points, known_partitions=frozenset()) -> set:
+    """
+    Insert (app_id, metric, timestamp, value) points. A point already stored
+    takes the new value, since CloudWatch revises the datapoint of a period
+    that was still filling in. Returns the days whose partitions were
+    ensured; the caller commits.
+    """
+    # One row per key, the latest value: ON CONFLICT cannot touch a row twice
+    rows = list({
+        (app_id, metric, ts): {"application_id": uuid.UUID(str(app_id)), "metric": metric, "ts": ts, "value": value}
+        for app_id, metric, ts, value in points
+    }.values())
+    days = {row["ts"].astimezone(timezone.utc).date() for row in rows} - set(known_partitions)
+    if days:
+        ensure_partitions(db, days)
+    for start in range(0, len(rows), _INSERT_CHUNK):
+        statement = insert(MetricSample).values(rows[start:start + _INSERT_CHUNK])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["application_id", "ts", "metric"],
+            set_={"value": statement.excluded.value},
+            # Unchanged points leave no dead row behind
+            where=MetricSample.value.is_distinct_from(statement.excluded.value)
+        ))
+    return days
+
+
+class HistoryWriter:
+    """
+    Buffers collected datapoints and writes them to observability.metric_samples
+    in multi-row inserts from a background thread, creating daily partitions
+    on demand and dropping the ones past HISTORY_RETENTION_DAYS.
+
+    Points the poller reads again on a later poll update the stored value.
+    Flushes run one at a time, so when flush() returns, every point added
+    before it was called is committed.
+    """
+
+    def __init__(self):
+        self._buffer = []  # (app_id, metric, ts, value)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._partitions = set()
+        self._retention_checked_at = 0.0
+        self._thread = None
+
+    def add(self, points):
+        """
+        Queue (app_id, metric, timestamp, value) points; never blocks on the database.
+        """
+        with self._lock:
+            self._buffer.extend(points)
+            overflow = len(self._buffer) - HISTORY_MAX_BUFFER
+            if overflow > 0:
+                del self._buffer[:overflow]
+                print(f"[History] Buffer full, dropped {overflow} oldest points")
+            if len(self._buffer) >= HISTORY_BATCH_SIZE:
+                self._wake.set()
+
+    def flush(self) -> int:
+        # Waits for a flush in progress, whose points may still be uncommitted
+        with self._flush_lock:
+            with self._lock:
+                points, self._buffer = self._buffer, []
+            if not points:
+                return 0
+
+            db: Session = Session_local()
+            try:
+                created = insert_samples(db, points, self._partitions)
+                db.commit()
+                self._partitions |= created
+            except Exception:
+                db.rollback()
+                # Keep the points for the next attempt
+                with self._lock:
+                    self._buffer[:0] = points
+                raise
+            finally:
+                db.close()
+            return len(points)
+
+    def _enforce_retention(self):
+        db: Session = Session_local()
+        try:
+            dropped = drop_expired_partitions(db)
+            db.commit()
+        finally:
+            db.close()
+        if dropped:
+            self._partitions -= {
+                datetime.strptime(name[len(_PARTITION_PREFIX):], "%Y%m%d").date() for name in dropped
+            }
+            print(f"[History] Dropped {len(dropped)} expired partitions")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(HISTORY_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._retention_checked_at >= HISTORY_RETENTION_CHECK_INTERVAL:
+                    self._retention_checked_at = time.monotonic()
+                    self._enforce_retention()
+            except Exception as e:
+                print(f"[History] Write failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the writer and flush what is still buffered.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=HISTORY_FLUSH_INTERVAL)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[History] Final flush failed: {e}")
+
+
+def query_history(db: Session, app_id, start: datetime, end: datetime, step: int) -> dict:
+    """
+    Average of every metric of an application per step-second bucket in
+    [start, end). Returns {metric: [{"timestamp", "value"}, ...]}.
+    """
+    rows = db.execute(
+        text(
+            "SELECT metric, "
+            "to_timestamp(floor(extract(epoch FROM ts) / :step) * :step) AS bucket, "
+            "avg(value) AS value "
+            "FROM observability.metric_samples "
+            "WHERE application_id = :app_id AND ts >= :start AND ts < :end "
+            "GROUP BY metric, bucket "
+            "ORDER BY metric, bucket"
+        ),
+        {"app_id": app_id, "start": start, "end": end, "step": step}
+    )
+
+    series = {}
+    for metric, bucket, value in rows:
+        series.setdefault(metric, []).append({"timestamp": bucket.isoformat(), "value": value})
+    return series
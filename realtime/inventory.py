@@ -0,0 +1,193 @@
+import os
+import json
+import time
+from datetime import timedelta
+from sqlalchemy import select, text, func
+from sqlalchemy.orm import Session
+from database.database import Session_local, engine
+from database.models import Application
+
+# Postgres channel the application repo notifies on every change
+INVENTORY_CHANNEL = "observability_applications"
+# Rows changed this long before the cursor are re-read, covering commits
+# that land out of updated_at order
+INVENTORY_CURSOR_OVERLAP = timedelta(seconds=60)
+# Full id scan that catches deletes whose notification was missed
+INVENTORY_RECONCILE_INTERVAL = int(os.getenv("INVENTORY_RECONCILE_INTERVAL", "600"))  # seconds
+INVENTORY_FETCH_SIZE = 1000
+
+# Only what the poller needs; no full ORM objects
+INVENTORY_COLUMNS = (
+    Application.id,
+    Application.name,
+    Application.collector_type,
+    Application.cloud,
+    Application.region,
+    Application.instance_id,
+    Application.bucket_name,
+    Application.function_name,
+    Application.aws_access_key_id,
+    Application.aws_secret_access_key,
+    Application.is_active,
+    Application.updated_at,
+)
+
+
+def notify_application_change(db: Session, action: str, app_id):
+    """
+    Queue a change notification; Postgres delivers it when db commits.
+    action: "upsert" or "delete"
+    """
+    db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": INVENTORY_CHANNEL, "payload": json.dumps({"action": action, "id": str(app_id)})}
+    )
+
+
+class ApplicationInventory:
+    """
+    In-memory copy of the active applications the poller works from.
+
+    The first sync streams a column-projected query over the whole table.
+    Later syncs only apply changes: ids announced on INVENTORY_CHANNEL are
+    re-read, rows whose updated_at moved past the cursor are re-read (for
+    writers that do not notify), and a periodic id scan drops rows deleted
+    while no listener was connected.
+    """
+
+    def __init__(self):
+        self.rows = {}  # app_id -> projected row
+        self._cursor = None
+        self._listener = None
+        self._loaded = False
+        self._reconciled_at = 0.0
+
+    # ---------------- LISTEN/NOTIFY ----------------
+
+    def _listen(self):
+        """
+        Open a dedicated connection (outside the pool) that LISTENs for
+        changes. Drivers without notification support fall back to the
+        updated_at cursor alone.
+        """
+        try:
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            connection = engine.dialect.dbapi.connect(*cargs, **cparams)
+            if not hasattr(connection, "notifies"):
+                connection.close()
+                return
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {INVENTORY_CHANNEL}")
+            self._listener = connection
+        except Exception as e:
+            print(f"[Inventory] LISTEN unavailable, using updated_at cursor only: {e}")
+            self._listener = None
+
+    def _drain_notifications(self) -> set:
+        if self._listener is None:
+            self._listen()
+            return set()
+
+        ids = set()
+        try:
+            self._listener.poll()
+            while self._listener.notifies:
+                notification = self._listener.notifies.pop(0)
+                try:
+                    ids.add(json.loads(notification.payload)["id"])
+                except (ValueError, KeyError):
+                    continue
+        except Exception as e:
+            print(f"[Inventory] Lost LISTEN connection: {e}")
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+        return ids
+
+    # ---------------- SYNC ----------------
+
+    def _apply(self, rows, changed: set, removed: set):
+        for row in rows:
+            app_id = str(row.id)
+            if row.updated_at is not None and (self._cursor is None or row.updated_at > self._cursor):
+                self._cursor = row.updated_at
+            if row.is_active:
+                self.rows[app_id] = row
+                changed.add(app_id)
+                removed.discard(app_id)
+            elif self.rows.pop(app_id, None) is not None:
+                removed.add(app_id)
+
+    def _load(self, db: Session, changed: set, removed: set):
+        # Listen first so nothing committed during the load is missed
+        self._listen()
+        result = db.execute(
+            select(*INVENTORY_COLUMNS)
+            .where(Application.is_active.is_(True))
+            .execution_options(yield_per=INVENTORY_FETCH_SIZE)
+        )
+        self._apply(result, changed, removed)
+        if self._cursor is None:
+            self._cursor = db.execute(select(func.now())).scalar()
+        self._loaded = True
+        self._reconciled_at = time.monotonic()
+        print(f"[Inventory] Loaded {len(self.rows)} applications")
+
+    def _reconcile(self, db: Session, removed: set):
+        active = {
+            str(app_id) for app_id in db.execute(
+                select(Application.id)
+                .where(Application.is_active.is_(True))
+                .execution_options(yield_per=INVENTORY_FETCH_SIZE)
+            ).scalars()
+        }
+        for app_id in set(self.rows) - active:
+            del self.rows[app_id]
+            removed.add(app_id)
+        self._reconciled_at = time.monotonic()
+
+    def sync(self):
+        """
+        Bring the inventory up to date.
+        Returns (changed, removed): sets of app ids added or modified, and
+        app ids that are gone or no longer active.
+        """
+        changed, removed = set(), set()
+        db: Session = Session_local()
+        try:
+            if not self._loaded:
+                self._load(db, changed, removed)
+                return changed, removed
+
+            notified = self._drain_notifications()
+            if notified:
+                rows = db.execute(
+                    select(*INVENTORY_COLUMNS).where(Application.id.in_(notified))
+                ).all()
+                found = {str(row.id) for row in rows}
+                self._apply(rows, changed, removed)
+                for app_id in notified - found:
+                    if self.rows.pop(app_id, None) is not None:
+                        removed.add(app_id)
+
+            rows = db.execute(
+                select(*INVENTORY_COLUMNS)
+                .where(Application.updated_at > self._cursor - INVENTORY_CURSOR_OVERLAP)
+            ).all()
+            # Re-read rows that did not change are not reported again
+            unchanged = {
+                str(row.id) for row in rows
+                if str(row.id) in self.rows and self.rows[str(row.id)] == row
+            }
+            self._apply(rows, changed, removed)
+            changed -= unchanged - notified
+
+            if time.monotonic() - self._reconciled_at >= INVENTORY_RECONCILE_INTERVAL:
+                self._reconcile(db, removed)
+        finally:
+            db.close()
+
+        return changed, removed
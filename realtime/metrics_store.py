@@ -0,0 +1,358 @@
+import os
+import mmap
+import json
+import time
+import zlib
+import fcntl
+import struct
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import LatestMetric, LATEST_METRICS_VERSION
+
+# memory: this process only; shm: every process on the host; postgres: every host
+LATEST_METRICS_BACKEND = os.getenv("LATEST_METRICS_BACKEND", "memory").lower()
+
+# Shared memory backend
+LATEST_METRICS_SHM_PATH = os.getenv(
+    "LATEST_METRICS_SHM_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "observability-latest-metrics")
+)
+LATEST_METRICS_SHM_SLOTS = int(os.getenv("LATEST_METRICS_SHM_SLOTS", "8192"))
+LATEST_METRICS_SHM_SLOT_SIZE = int(os.getenv("LATEST_METRICS_SHM_SLOT_SIZE", "4096"))  # bytes
+
+# Postgres backend: how stale a worker's local copy may get
+LATEST_METRICS_REFRESH_INTERVAL = float(os.getenv("LATEST_METRICS_REFRESH_INTERVAL", "1"))  # seconds
+# Full reload that picks up rows whose version committed out of order
+LATEST_METRICS_RESYNC_INTERVAL = float(os.getenv("LATEST_METRICS_RESYNC_INTERVAL", "60"))  # seconds
+
+_MISSING = object()
+
+
+class LatestMetricsStore(ABC):
+    """
+    Latest metrics sample per application id.
+
+    Samples are replaced whole and never mutated in place, so get() hands
+    back the stored dict itself; callers must treat it as read-only.
+    """
+
+    @abstractmethod
+    def get(self, app_id: str, default=None):
+        ...
+
+    @abstractmethod
+    def __setitem__(self, app_id: str, metrics: dict):
+        ...
+
+    @abstractmethod
+    def pop(self, app_id: str, default=None):
+        ...
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+    def update(self, samples: dict):
+        """
+        Store several samples; backends override this to write them at once.
+        """
+        for app_id, metrics in samples.items():
+            self[app_id] = metrics
+
+    def __getitem__(self, app_id: str):
+        metrics = self.get(app_id, _MISSING)
+        if metrics is _MISSING:
+            raise KeyError(app_id)
+        return metrics
+
+    def __contains__(self, app_id: str):
+        return self.get(app_id, _MISSING) is not _MISSING
+
+
+# ---------------- IN-PROCESS ----------------
+
+class MemoryMetricsStore(LatestMetricsStore):
+    """
+    Plain dict; only visible inside the process running the poller.
+    """
+
+    def __init__(self):
+        self._samples = {}
+
+    def get(self, app_id: str, default=None):
+        return self._samples.get(app_id, default)
+
+    def __setitem__(self, app_id: str, metrics: dict):
+        self._samples[app_id] = metrics
+
+    def update(self, samples: dict):
+        self._samples.update(samples)
+
+    def pop(self, app_id: str, default=None):
+        return self._samples.pop(app_id, default)
+
+    def __len__(self):
+        return len(self._samples)
+
+
+# ---------------- SHARED MEMORY ----------------
+
+# version, state, key length, payload length, key
+_SLOT_HEADER = struct.Struct("<QBBI64s")
+_EMPTY, _USED, _DELETED = 0, 1, 2
+
+
+class SharedMemoryMetricsStore(LatestMetricsStore):
+    """
+    Open-addressing hash table in a memory-mapped file shared by every
+    worker on the host.
+
+    Each fixed-size slot holds one application's sample as JSON behind a
+    seqlock: writers (serialized with flock) make the version odd while
+    they write and even again when done, and readers retry when the version
+    moved under them. Readers keep the decoded sample with the version it
+    was read at, so repeated reads of an unchanged slot cost one header
+    read and return the same dict without decoding or copying.
+    """
+
+    def __init__(self, path: str = LATEST_METRICS_SHM_PATH,
+                 slots: int = LATEST_METRICS_SHM_SLOTS,
+                 slot_size: int = LATEST_METRICS_SHM_SLOT_SIZE):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - _SLOT_HEADER.size
+        size = slots * slot_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._view = memoryview(self._map)
+        self._lock = threading.Lock()
+        self._decoded = {}  # app_id -> (slot, version, sample)
+
+    def _header(self, slot: int):
+        return _SLOT_HEADER.unpack_from(self._map, slot * self.slot_size)
+
+    def _probe(self, key: bytes):
+        start = zlib.crc32(key) % self.slots
+        for step in range(self.slots):
+            yield (start + step) % self.slots
+
+    def _find(self, key: bytes):
+        """
+        Slot holding key and its version, or (None, 0).
+        """
+        for slot in self._probe(key):
+            version, state, key_len, _, slot_key = self._header(slot)
+            if state == _EMPTY:
+                return None, 0
+            if state == _USED and slot_key[:key_len] == key:
+                return slot, version
+        return None, 0
+
+    def get(self, app_id: str, default=None):
+        key = app_id.encode()
+        for _ in range(100):
+            slot, version = self._find(key)
+            if slot is None:
+                return default
+            if version & 1:
+                continue  # write in progress
+
+            cached = self._decoded.get(app_id)
+            if cached and cached[0] == slot and cached[1] == version:
+                return cached[2]
+
+            _, state, key_len, length, slot_key = self._header(slot)
+            offset = slot * self.slot_size + _SLOT_HEADER.size
+            raw = bytes(self._view[offset:offset + length])
+            if self._header(slot)[0] != version:
+                continue
+            if state != _USED or slot_key[:key_len] != key:
+                return default
+
+            sample = json.loads(raw)
+            self._decoded[app_id] = (slot, version, sample)
+            return sample
+        return default
+
+    def _write(self, slot: int, state: int, key: bytes, payload: bytes):
+        base = slot * self.slot_size
+        version = self._header(slot)[0]
+        struct.pack_into("<Q", self._map, base, version + 1)
+        self._view[base + _SLOT_HEADER.size:base + _SLOT_HEADER.size + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self._map, base, version + 1, state, len(key), len(payload), key)
+        struct.pack_into("<Q", self._map, base, version + 2)
+
+    def _set(self, app_id: str, metrics: dict):
+        key = app_id.encode()
+        payload = json.dumps(metrics, default=str).encode()
+        if len(payload) > self.capacity:
+            raise ValueError(f"Metrics sample of {len(payload)} bytes exceeds the {self.capacity} byte slot")
+
+        free = None
+        for slot in self._probe(key):
+            _, state, key_len, _, slot_key = self._header(slot)
+            if state == _USED and slot_key[:key_len] == key:
+                free = slot
+                break
+            if state == _DELETED and free is None:
+                free = slot
+            if state == _EMPTY:
+                free = slot if free is None else free
+                break
+        if free is None:
+            raise ValueError("Shared metrics store is full; raise LATEST_METRICS_SHM_SLOTS")
+        self._write(free, _USED, key, payload)
+
+    def _locked(self, work, *args):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return work(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __setitem__(self, app_id: str, metrics: dict):
+        self._locked(self._set, app_id, metrics)
+
+    def update(self, samples: dict):
+        def write_all():
+            for app_id, metrics in samples.items():
+                self._set(app_id, metrics)
+        self._locked(write_all)
+
+    def _pop(self, app_id: str, default):
+        value = self.get(app_id, _MISSING)
+        if value is _MISSING:
+            return default
+        slot, _ = self._find(app_id.encode())
+        if slot is not None:
+            self._write(slot, _DELETED, b"", b"")
+        self._decoded.pop(app_id, None)
+        return value
+
+    def pop(self, app_id: str, default=None):
+        return self._locked(self._pop, app_id, default)
+
+    def __len__(self):
+        return sum(1 for slot in range(self.slots) if self._header(slot)[1] == _USED)
+
+
+# ---------------- POSTGRES ----------------
+
+class PostgresMetricsStore(LatestMetricsStore):
+    """
+    observability.latest_metrics (UNLOGGED) shared by workers on any host.
+
+    Every process reads from a local copy. At most once per
+    LATEST_METRICS_REFRESH_INTERVAL a read pulls the rows whose version is
+    newer than the newest one it has seen, so keeping the copy current costs
+    one indexed range scan over what changed, not one query per read.
+    Versions are taken before commit, so a periodic full reload catches
+    a write that committed after a newer one had already been read.
+    """
+
+    def __init__(self, refresh_interval: float = LATEST_METRICS_REFRESH_INTERVAL,
+                 resync_interval: float = LATEST_METRICS_RESYNC_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self._samples = {}
+        self._version = 0
+        self._refreshed_at = 0.0
+        self._resynced_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        with self._lock:
+            if time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            resync = time.monotonic() - self._resynced_at >= self.resync_interval
+            query = select(LatestMetric.application_id, LatestMetric.version, LatestMetric.payload)
+            if not resync:
+                query = query.where(LatestMetric.version > self._version)
+
+            db: Session = Session_local()
+            try:
+                rows = db.execute(query.order_by(LatestMetric.version)).all()
+            except Exception as e:
+                print(f"[MetricsStore] Refresh failed: {e}")
+                return
+            finally:
+                db.close()
+
+            if resync:
+                self._samples = {}
+                self._resynced_at = time.monotonic()
+            for app_id, version, payload in rows:
+                if payload is None:
+                    self._samples.pop(app_id, None)
+                else:
+                    self._samples[app_id] = payload
+                self._version = max(self._version, version)
+            self._refreshed_at = time.monotonic()
+
+    def get(self, app_id: str, default=None):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self._refresh()
+        return self._samples.get(app_id, default)
+
+    def _upsert(self, samples: dict):
+        db: Session = Session_local()
+        try:
+            statement = insert(LatestMetric).values([
+                {"application_id": app_id, "payload": payload}
+                for app_id, payload in samples.items()
+            ])
+            db.execute(statement.on_conflict_do_update(
+                index_elements=["application_id"],
+                set_={"payload": statement.excluded.payload, "version": LATEST_METRICS_VERSION.next_value()}
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def __setitem__(self, app_id: str, metrics: dict):
+        self.update({app_id: metrics})
+
+    def update(self, samples: dict):
+        if not samples:
+            return
+        # Round-trip through JSON so the local copy matches what readers decode
+        samples = {app_id: json.loads(json.dumps(metrics, default=str)) for app_id, metrics in samples.items()}
+        self._upsert(samples)
+        self._samples.update(samples)
+
+    def pop(self, app_id: str, default=None):
+        value = self.get(app_id, default)
+        # A tombstone, so other workers see the removal on their next refresh
+        self._upsert({app_id: None})
+        self._samples.pop(app_id, None)
+        return value
+
+    def __len__(self):
+        self._refresh()
+        return len(self._samples)
+
+
+def create_latest_metrics_store(backend: str = LATEST_METRICS_BACKEND) -> LatestMetricsStore:
+    """
+    Store selected by LATEST_METRICS_BACKEND.
+    """
+    if backend == "memory":
+        return MemoryMetricsStore()
+    if backend == "shm":
+        return SharedMemoryMetricsStore()
+    if backend == "postgres":
+        return PostgresMetricsStore()
+    raise ValueError(f"Unknown LATEST_METRICS_BACKEND: {backend}")
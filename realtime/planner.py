@@ -0,0 +1,272 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional
+from metrics.aws import build_ec2_metric_specs, format_ec2_metrics, EC2_LOOKBACK
+from metrics.aws_S3 import build_S3_metric_specs, format_S3_metrics, S3_LOOKBACK
+from metrics.aws_labda import build_lambda_metric_specs, format_lambda_metrics, LAMBDA_LOOKBACK
+from helper.aws_clients import credential_identity
+from helper.yamlLoader import MetricsConfig
+from metrics.aws_batch_fetcher import (
+    MAX_QUERIES_PER_REQUEST,
+    query_signature,
+    metric_query,
+    fetch_metric_data
+)
+
+# Furthest back an incremental fetch reaches after the poller was stopped;
+# older gaps are left to the backfill
+WATERMARK_MAX_CATCHUP = int(os.getenv("WATERMARK_MAX_CATCHUP", "10800"))  # seconds
+
+# How each collector type turns an application into metric specs, and a
+# stored sample into the dashboard view streamed to clients
+COLLECTORS = {
+    "ec2": {
+        "target_field": "instance_id",
+        "sections": ("ec2", "cwagent"),
+        "lookback": EC2_LOOKBACK,
+        "build_specs": lambda config, target: build_ec2_metric_specs(
+            config, target, agent_installed=True
+        ),
+        "format": format_ec2_metrics,
+    },
+    "s3": {
+        "target_field": "bucket_name",
+        "sections": ("s3",),
+        "lookback": S3_LOOKBACK,
+        "build_specs": build_S3_metric_specs,
+        "format": format_S3_metrics,
+    },
+    "lambda": {
+        "target_field": "function_name",
+        "sections": ("lambda",),
+        "lookback": LAMBDA_LOOKBACK,
+        "build_specs": build_lambda_metric_specs,
+        "format": format_lambda_metrics,
+    },
+}
+
+
+def poll_target(
+    application,
+    aws_access_key_id: Optional[str] = None,
+    aws_secret_access_key: Optional[str] = None
+) -> dict:
+    """
+    Everything the planner needs to know about one application.
+    """
+    collector_type = application.collector_type.lower()
+    collector = COLLECTORS.get(collector_type)
+    return {
+        "app_id": str(application.id),
+        "app_name": application.name,
+        "collector_type": collector_type,
+        "region": application.region,
+        "target": getattr(application, collector["target_field"]) if collector else None,
+        "aws_access_key_id": aws_access_key_id,
+        "aws_secret_access_key": aws_secret_access_key,
+        "identity": credential_identity(aws_access_key_id, aws_secret_access_key),
+    }
+
+
+def target_groups(target: dict) -> tuple:
+    """
+    Metric groups to poll for a target: the due ones, or all of its collector's.
+    """
+    return target.get("groups") or COLLECTORS[target["collector_type"]]["sections"]
+
+
+def empty_sample(target: dict, config: MetricsConfig) -> dict:
+    """
+    Sample skeleton in the shape the single-application collectors return,
+    limited to the metric groups being polled. Skipped metrics are left out,
+    so the value stored before keeps showing.
+    """
+    collector = COLLECTORS[target["collector_type"]]
+    skip = target.get("skip", ())
+    sample = {
+        collector["target_field"]: target["target"],
+        "region": target["region"],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+    for section in target_groups(target):
+        for metric_key in config.keys.get(section, ()):
+            if metric_key not in skip:
+                sample[metric_key] = None
+    return sample
+
+
+def _new_batch(region: str, identity: str, lookback, target: dict) -> dict:
+    return {
+        "region": region,
+        "identity": identity,
+        "lookback": lookback,
+        "aws_access_key_id": target["aws_access_key_id"],
+        "aws_secret_access_key": target["aws_secret_access_key"],
+        "targets": [],
+        "queries": [],
+        "query_keys": {},  # query id -> [(app_id, group, metric_key), ...]
+        "signatures": {},  # query_signature -> query id
+        "since": {},  # (app_id, metric_key) -> (watermark or None, period)
+    }
+
+
+def _target_specs(target: dict, config: MetricsConfig) -> list:
+    collector = COLLECTORS[target["collector_type"]]
+    groups = target_groups(target)
+    skip = target.get("skip", ())
+    return [
+        spec for spec in collector["build_specs"](config, target["target"])
+        if spec["group"] in groups and spec["key"] not in skip
+    ]
+
+
+def plan_poll_cycle(targets: list, config: MetricsConfig, watermarks: Optional[dict] = None) -> list:
+    """
+    Group applications by (region, credential identity, lookback window) and
+    pack their metric queries into as few GetMetricData requests as the
+    per-request query limit allows. An application never spans two batches.
+
+    watermarks maps app_id -> {metric_key: newest datapoint timestamp seen}.
+    Applications with a watermark for every metric are batched apart from
+    the others, so their requests start at the oldest watermark instead of
+    a full lookback window. Metric keys in a target's "skip" are not queried.
+
+    Applications watching the same resource share its queries: every
+    distinct query signature is requested once per batch and its datapoints
+    are fanned out to each application that needs them.
+    """
+    watermarks = watermarks or {}
+    groups = {}
+    for target in targets:
+        collector = COLLECTORS[target["collector_type"]]
+        specs = _target_specs(target, config)
+        seen = watermarks.get(target["app_id"], {})
+        incremental = bool(specs) and all(spec["key"] in seen for spec in specs)
+        key = (target["region"], target["identity"], collector["lookback"], incremental)
+        groups.setdefault(key, []).append((target, specs))
+
+    batches = []
+    for (region, identity, lookback, _), group in groups.items():
+        # Applications on the same resource next to each other, so they
+        # land in the same batch and share its queries
+        group.sort(key=lambda item: (item[0]["collector_type"], item[0]["target"] or ""))
+        batch = _new_batch(region, identity, lookback, group[0][0])
+
+        for target, specs in group:
+            signatures = [query_signature(spec) for spec in specs]
+            new = {signature for signature in signatures if signature not in batch["signatures"]}
+
+            if batch["targets"] and len(batch["queries"]) + len(new) > MAX_QUERIES_PER_REQUEST:
+                batches.append(batch)
+                batch = _new_batch(region, identity, lookback, target)
+
+            batch["targets"].append(target)
+            seen = watermarks.get(target["app_id"], {})
+            for spec, signature in zip(specs, signatures):
+                query_id = batch["signatures"].get(signature)
+                if query_id is None:
+                    query_id = f"q{len(batch['queries'])}"
+                    batch["signatures"][signature] = query_id
+                    batch["queries"].append(metric_query(query_id, spec))
+                    batch["query_keys"][query_id] = []
+                batch["query_keys"][query_id].append((target["app_id"], spec["group"], spec["key"]))
+                batch["since"][(target["app_id"], spec["key"])] = (seen.get(spec["key"]), spec["period"])
+
+        batches.append(batch)
+
+    return batches
+
+
+def _window_start(batch: dict, end_time: datetime) -> datetime:
+    """
+    Earliest period any query of the batch still needs: the one holding its
+    watermark (CloudWatch may still have been filling it in when it was
+    read), or a full lookback without one, never further back than
+    WATERMARK_MAX_CATCHUP. Aligned to each metric's period.
+    """
+    end = end_time.timestamp()
+    oldest = end - batch["lookback"].total_seconds()
+    catch_up = end - max(WATERMARK_MAX_CATCHUP, batch["lookback"].total_seconds())
+
+    start = end
+    for watermark, period in batch["since"].values():
+        if watermark is None:
+            needed = oldest
+        else:
+            needed = max(watermark.timestamp(), catch_up)
+        start = min(start, needed - needed % period)
+
+    # Requests must cover at least one minute
+    start = min(start, end - 60)
+    return datetime.fromtimestamp(start, timezone.utc)
+
+
+def execute_batch(batch: dict, config: MetricsConfig):
+    """
+    Run one planned batch and fan the values back out per application id.
+    Returns (samples, last_seen, points): the sample of every application,
+    the newest datapoint timestamp of every polled (app_id, group) or None,
+    and every new (app_id, metric_key, timestamp, value) datapoint, oldest
+    first per metric.
+
+    Each sample holds the newest value of a metric plus, under "datapoints",
+    the [timestamp, value] pairs from its watermark on (only the newest one
+    on a metric's first poll). The watermark's own datapoint is read again,
+    since its period may have been partial, and its value replaces the one
+    stored. A metric with no datapoint since is left out of the sample so
+    the previous value stays, until its watermark is older than the
+    lookback window.
+    """
+    samples = {
+        target["app_id"]: empty_sample(target, config)
+        for target in batch["targets"]
+    }
+    last_seen = {
+        (target["app_id"], group): None
+        for target in batch["targets"]
+        for group in target_groups(target)
+    }
+    points = []
+    if not batch["queries"]:
+        return samples, last_seen, points
+
+    end_time = datetime.now(timezone.utc)
+    datapoints = fetch_metric_data(
+        region=batch["region"],
+        queries=batch["queries"],
+        start_time=_window_start(batch, end_time),
+        end_time=end_time,
+        aws_access_key_id=batch["aws_access_key_id"],
+        aws_secret_access_key=batch["aws_secret_access_key"]
+    )
+
+    stale_before = end_time - batch["lookback"]
+    for query_id, keys in batch["query_keys"].items():
+        query_points = sorted(datapoints.get(query_id) or ())
+        for app_id, group, metric_key in keys:
+            watermark = batch["since"].get((app_id, metric_key), (None, None))[0]
+            sample = samples[app_id]
+
+            if watermark is None:
+                new = query_points
+                listed = query_points[-1:]
+            else:
+                new = listed = [point for point in query_points if point[0] >= watermark]
+
+            newest = new[-1][0] if new else watermark
+            seen = last_seen[(app_id, group)]
+            if newest is not None and (seen is None or newest > seen):
+                last_seen[(app_id, group)] = newest
+
+            if not new:
+                if watermark is not None and watermark >= stale_before:
+                    sample.pop(metric_key, None)
+                continue
+
+            sample[metric_key] = new[-1][1]
+            sample.setdefault("datapoints", {})[metric_key] = [
+                [timestamp.isoformat(), value] for timestamp, value in listed
+            ]
+            points.extend((app_id, metric_key, timestamp, value) for timestamp, value in new)
+
+    return samples, last_seen, points
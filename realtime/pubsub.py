@@ -0,0 +1,223 @@
+import os
+import uuid
+import asyncio
+import contextvars
+from typing import Optional
+
+# Comment line sent to idle streams so proxies keep them open
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))  # seconds
+# How often watched applications are re-read from the store, catching
+# samples written by pollers in other workers
+HUB_CHECK_INTERVAL = float(os.getenv("HUB_CHECK_INTERVAL", "5"))  # seconds
+
+
+class _Topic:
+    __slots__ = ("frame", "subscriptions")
+
+    def __init__(self):
+        self.frame = None  # newest published Frame
+        self.subscriptions = set()
+
+
+class Subscription:
+    """
+    The applications one stream follows. Any of them changing wakes the
+    stream once; it then sends the newest frame of each changed application.
+    """
+    __slots__ = ("id", "user_id", "app_ids", "pending", "wake", "version")
+
+    def __init__(self, user_id=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.version = None  # change version held, for registered streams
+        self.app_ids = set()
+        self.pending = set()  # app_ids with a frame not sent yet
+        self.wake = asyncio.Event()
+
+
+class MetricsHub:
+    """
+    Publish/subscribe of per-application samples for the streaming endpoints.
+
+    The poller thread publishes every sample it stores; the hub hands it to
+    the event loop with call_soon_threadsafe, turns it into a Frame (formatted
+    and serialized once, see FrameCache) and wakes the application's
+    subscribers, which all send the same bytes. A sample no newer (by
+    collected_at) than the last one is not published.
+
+    Only applications with subscribers are tracked. They are also re-read
+    from the store every HUB_CHECK_INTERVAL (off the event loop), so samples
+    written by another worker's poller reach this worker's streams too.
+    Registered subscriptions are synced with the stream registry at the same
+    pace, picking up changes made through other workers.
+    """
+
+    def __init__(self, store, frames, streams=None):
+        self._store = store
+        self._frames = frames
+        self._streams = streams
+        self._loop = None
+        self._watcher = None
+        self._topics = {}  # app_id -> _Topic, only touched on the event loop
+        self._subscriptions = {}  # Subscription.id -> Subscription
+
+    # ---------------- Publishing (any thread) ----------------
+
+    def publish(self, app_id: str, sample: dict):
+        self.publish_many({app_id: sample})
+
+    def publish_many(self, samples: dict):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        # Membership reads are safe off the loop; skip unwatched applications
+        watched = {app_id: sample for app_id, sample in samples.items() if app_id in self._topics}
+        if watched:
+            loop.call_soon_threadsafe(self._apply, watched)
+
+    # ---------------- Event loop side ----------------
+
+    def _apply(self, samples: dict):
+        for app_id, sample in samples.items():
+            topic = self._topics.get(app_id)
+            if topic is None or not sample:
+                continue
+            # The cache keeps the newer frame when a store copy lags behind
+            # the poller's own publish
+            frame = self._frames.get(app_id, sample)
+            if frame is topic.frame:
+                continue
+            topic.frame = frame
+            for subscription in topic.subscriptions:
+                subscription.pending.add(app_id)
+                subscription.wake.set()
+
+    def _start(self):
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.get_running_loop()
+            # In a context of its own, not that of the request that started it
+            self._watcher = self._loop.create_task(self._watch(), context=contextvars.Context())
+
+    def _read(self, app_ids: list) -> dict:
+        return {app_id: self._store.get(app_id) for app_id in app_ids}
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(HUB_CHECK_INTERVAL)
+            if self._topics:
+                try:
+                    self._apply(await asyncio.to_thread(self._read, list(self._topics)))
+                except Exception as e:
+                    print(f"[Hub] Store read failed: {e}")
+
+            registered = {
+                subscription.id: subscription.version
+                for subscription in self._subscriptions.values()
+                if subscription.version is not None
+            }
+            if registered:
+                try:
+                    changes = await asyncio.to_thread(self._streams.sync, registered)
+                except Exception as e:
+                    print(f"[Hub] Stream sync failed: {e}")
+                    continue
+                for stream_id, (version, app_ids) in changes.items():
+                    subscription = self._subscriptions.get(stream_id)
+                    if subscription is not None:
+                        await self.apply_change(subscription, version, app_ids)
+
+    # ---------------- Subscriptions (event loop) ----------------
+
+    async def subscribe(self, app_ids, user_id=None, register: bool = False) -> Subscription:
+        """
+        New subscription to the given applications; iterate it with updates().
+        With register, it is recorded in the stream registry so any worker
+        can change its applications.
+        """
+        self._start()
+        subscription = Subscription(user_id)
+        if register:
+            await asyncio.to_thread(self._streams.open, subscription.id, user_id, list(app_ids))
+            subscription.version = 0
+        self._subscriptions[subscription.id] = subscription
+        await self.add(subscription, app_ids)
+        return subscription
+
+    async def apply_change(self, subscription: Subscription, version: int, app_ids: list):
+        """
+        Make a registered subscription follow app_ids as of version, unless
+        it already holds that version or a newer one.
+        """
+        if subscription.version is None or version <= subscription.version:
+            return
+        subscription.version = version
+        self.remove(subscription, subscription.app_ids - set(app_ids))
+        await self.add(subscription, app_ids)
+
+    def find(self, subscription_id: str) -> Optional[Subscription]:
+        return self._subscriptions.get(subscription_id)
+
+    async def add(self, subscription: Subscription, app_ids):
+        """
+        Follow more applications; their current frames are sent next.
+        """
+        missing = []
+        for app_id in app_ids:
+            if app_id in subscription.app_ids:
+                continue
+            subscription.app_ids.add(app_id)
+            topic = self._topics.get(app_id)
+            if topic is None:
+                topic = self._topics[app_id] = _Topic()
+            topic.subscriptions.add(subscription)
+            if topic.frame is None:
+                missing.append(app_id)
+            else:
+                subscription.pending.add(app_id)
+        if missing:
+            self._apply(await asyncio.to_thread(self._read, missing))
+        subscription.wake.set()
+
+    def remove(self, subscription: Subscription, app_ids):
+        for app_id in app_ids:
+            subscription.app_ids.discard(app_id)
+            subscription.pending.discard(app_id)
+            topic = self._topics.get(app_id)
+            if topic is None:
+                continue
+            topic.subscriptions.discard(subscription)
+            if not topic.subscriptions:
+                del self._topics[app_id]
+
+    def close(self, subscription: Subscription):
+        self.remove(subscription, list(subscription.app_ids))
+        if self._subscriptions.pop(subscription.id, None) is not None and subscription.version is not None:
+            # Off the event loop, without waiting for it
+            self._loop.run_in_executor(None, self._streams.close, [subscription.id])
+
+    async def updates(self, subscription: Subscription):
+        """
+        Yield a list of (app_id, Frame) whenever followed applications
+        change, starting with their current frames, and None after every
+        SSE_HEARTBEAT_INTERVAL without a change. Closes the subscription
+        when the consumer stops.
+        """
+        try:
+            while True:
+                if subscription.pending:
+                    changed = []
+                    for app_id in subscription.pending:
+                        topic = self._topics.get(app_id)
+                        if topic is not None and topic.frame is not None:
+                            changed.append((app_id, topic.frame))
+                    subscription.pending.clear()
+                    if changed:
+                        yield changed
+                    continue
+                subscription.wake.clear()
+                try:
+                    await asyncio.wait_for(subscription.wake.wait(), SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.close(subscription)
@@ -0,0 +1,178 @@
+import os
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+# How much recent history is kept per application
+RING_BUFFER_WINDOW = int(os.getenv("RING_BUFFER_WINDOW", "3600"))  # seconds
+# Upper bound for all buffers together; least recently updated ones go first
+RING_BUFFER_MEMORY_BUDGET = int(os.getenv("RING_BUFFER_MEMORY_BUDGET_MB", "128")) * 1024 * 1024
+
+
+class RingSlice(NamedTuple):
+    # Each is a list of one or two memoryviews (two when the window wraps
+    # around the end of the buffer), in time order
+    timestamps: list
+    columns: dict
+
+    def __len__(self):
+        return sum(len(view) for view in self.timestamps)
+
+    def to_json(self) -> dict:
+        """
+        Plain lists for a JSON response; NaN becomes None.
+        """
+        return {
+            "timestamps": [timestamp for view in self.timestamps for timestamp in view],
+            "metrics": {
+                column: [None if value != value else value for view in views for value in view]
+                for column, views in self.columns.items()
+            }
+        }
+
+
+class RingBuffer:
+    """
+    Fixed-capacity columns of recent samples: int64 epoch seconds and one
+    float64 column per metric, NaN where a metric had no value.
+
+    Slices are memoryviews over the arrays, so reading a window copies
+    nothing; a view may see rows overwritten by appends made after it was taken.
+    """
+
+    def __init__(self, columns: tuple, capacity: int):
+        self.columns = columns
+        self.capacity = capacity
+        self._timestamps = array("q", bytes(8 * capacity))
+        self._values = {column: array("d", [math.nan]) * capacity for column in columns}
+        self._next = 0
+        self._size = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.capacity * 8 * (1 + len(self.columns))
+
+    def __len__(self):
+        return self._size
+
+    def newest_timestamp(self):
+        return self._timestamps[self._physical(self._size - 1)] if self._size else None
+
+    def append(self, timestamp: int, sample: dict, replace_last: bool = False):
+        """
+        Add a row, or overwrite the newest one when replace_last is set.
+        """
+        if replace_last and self._size:
+            index = self._physical(self._size - 1)
+        else:
+            index = self._next
+            self._next = (index + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+        self._timestamps[index] = timestamp
+        for column, values in self._values.items():
+            value = sample.get(column)
+            values[index] = math.nan if value is None else float(value)
+
+    def _physical(self, logical: int) -> int:
+        return (self._next - self._size + logical) % self.capacity
+
+    def last(self, count: int) -> RingSlice:
+        """
+        The newest count rows.
+        """
+        count = min(count, self._size)
+        start = self._physical(self._size - count)
+        if start + count <= self.capacity:
+            ranges = [(start, start + count)]
+        else:
+            ranges = [(start, self.capacity), (0, self._next)]
+
+        timestamps = memoryview(self._timestamps)
+        return RingSlice(
+            timestamps=[timestamps[a:b] for a, b in ranges],
+            columns={
+                column: [memoryview(values)[a:b] for a, b in ranges]
+                for column, values in self._values.items()
+            }
+        )
+
+    def since(self, timestamp: int) -> RingSlice:
+        """
+        Rows at or after timestamp, found by binary search.
+        """
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._physical(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return self.last(self._size - low)
+
+
+class RecentSamples:
+    """
+    One RingBuffer per application, sized to hold RING_BUFFER_WINDOW seconds
+    of its polls at the interval it is polled at, within
+    RING_BUFFER_MEMORY_BUDGET overall. Groups of one application are polled
+    separately, so samples recorded less than half an interval apart share
+    a row.
+    """
+
+    def __init__(self, interval: float, window: int = RING_BUFFER_WINDOW,
+                 budget: int = RING_BUFFER_MEMORY_BUDGET):
+        self.interval = interval  # when record() is not given one
+        self.window = window
+        self.budget = budget
+        self._buffers = OrderedDict()  # app_id -> RingBuffer, least recently updated first
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def record(self, app_id: str, columns: tuple, timestamp: int, sample: dict, interval: float = None):
+        """
+        Add a sample of an application polled every interval seconds.
+        """
+        interval = interval or self.interval
+        capacity = max(1, math.ceil(self.window / interval))
+        with self._lock:
+            buffer = self._buffers.get(app_id)
+            if buffer is None or buffer.columns != columns or buffer.capacity != capacity:
+                # New application, or the metrics config changed its columns or periods
+                if buffer is not None:
+                    self._nbytes -= buffer.nbytes
+                buffer = RingBuffer(columns, capacity)
+                self._nbytes += buffer.nbytes
+                self._buffers[app_id] = buffer
+                self._buffers.move_to_end(app_id)
+                while self._nbytes > self.budget and len(self._buffers) > 1:
+                    _, evicted = self._buffers.popitem(last=False)
+                    self._nbytes -= evicted.nbytes
+            self._buffers.move_to_end(app_id)
+
+            newest = buffer.newest_timestamp()
+            buffer.append(
+                timestamp,
+                sample,
+                replace_last=newest is not None and timestamp - newest < interval / 2
+            )
+
+    def since(self, app_id: str, timestamp: int):
+        """
+        RingSlice of an application's rows at or after timestamp, or None.
+        """
+        with self._lock:
+            buffer = self._buffers.get(app_id)
+            return buffer.since(timestamp) if buffer is not None else None
+
+    def forget(self, app_id: str):
+        with self._lock:
+            buffer = self._buffers.pop(app_id, None)
+            if buffer is not None:
+                self._nbytes -= buffer.nbytes
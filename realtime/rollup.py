@@ -0,0 +1,380 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, text, tuple_
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import MetricRollup
+
+# Name -> bucket width in seconds
+ROLLUP_RESOLUTIONS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+# Range served when a query gives no 'from'
+ROLLUP_DEFAULT_WINDOWS = {
+    "1m": timedelta(hours=6),
+    "5m": timedelta(days=1),
+    "1h": timedelta(days=30),
+    "1d": timedelta(days=365),
+}
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))  # seconds
+# A bucket no datapoint has reached for this long after its end is closed
+ROLLUP_CLOSE_GRACE = float(os.getenv("ROLLUP_CLOSE_GRACE", "300"))  # seconds
+
+# Buckets rebuilt per statement
+_UPSERT_CHUNK = 1000
+
+
+def _bucket_start(timestamp: float, resolution: int) -> float:
+    return timestamp - timestamp % resolution
+
+
+class RollupEngine:
+    """
+    Incremental min/max/sum/count/last aggregates of every metric at the
+    ROLLUP_RESOLUTIONS, fed with the datapoints the poller collects.
+
+    Each (application, metric, resolution) has one open bucket in memory. A
+    datapoint past its end closes it; so does ROLLUP_CLOSE_GRACE passing
+    without one. Closed buckets are rebuilt in observability.metric_rollups
+    from the stored samples (see upsert_rollups) by a background thread,
+    after flushing the history writer, so writing a bucket again never
+    counts a datapoint twice.
+
+    Datapoints a series has already seen are ignored. With resume, a series
+    the engine has not seen yet (after a restart or a shard move) starts
+    after the newest datapoint already stored for each resolution, so open
+    buckets never repeat what query_rollups reads from the stored rows.
+    Buckets and positions are indexed by application, then metric, so
+    resuming a series or forgetting an application touches only its own.
+    """
+
+    def __init__(self, resolutions: dict = ROLLUP_RESOLUTIONS, history=None, resume: bool = False):
+        self.resolutions = resolutions
+        self.history = history
+        self.resume = resume
+        # app_id -> {metric: {resolution: [start, min, max, sum, count, last, last_ts]}}
+        self._open = {}
+        self._seen = {}  # app_id -> {metric: {resolution: newest datapoint timestamp}}
+        self._closed = []  # ((app_id, metric, resolution), bucket) waiting to be written
+        # (app_id, metric) -> {resolution: newest last_ts of its closed, unwritten buckets}
+        self._unwritten = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, points):
+        """
+        Fold (app_id, metric, timestamp, value) datapoints into their buckets.
+        """
+        stored = {}
+        if self.resume:
+            with self._lock:
+                new = {
+                    (app_id, metric) for app_id, metric, _, _ in points
+                    if metric not in self._seen.get(app_id, ())
+                }
+            if new:
+                stored = self._stored_last_ts(new)
+
+        with self._lock:
+            for (app_id, metric), seen in stored.items():
+                app_seen = self._seen.setdefault(app_id, {})
+                if metric not in app_seen:
+                    app_seen[metric] = self._pending_last_ts(app_id, metric, seen)
+
+            for app_id, metric, timestamp, value in points:
+                if value is None:
+                    continue
+                ts = timestamp.timestamp()
+                seen = self._seen.setdefault(app_id, {}).setdefault(metric, {})
+                series = self._open.setdefault(app_id, {}).setdefault(metric, {})
+
+                for resolution in self.resolutions.values():
+                    if ts <= seen.get(resolution, float("-inf")):
+                        continue
+                    seen[resolution] = ts
+                    start = _bucket_start(ts, resolution)
+                    bucket = series.get(resolution)
+                    if bucket is not None and bucket[0] == start:
+                        bucket[1] = min(bucket[1], value)
+                        bucket[2] = max(bucket[2], value)
+                        bucket[3] += value
+                        bucket[4] += 1
+                        bucket[5] = value
+                        bucket[6] = ts
+                        continue
+                    if bucket is not None:
+                        self._close(app_id, metric, resolution, bucket)
+                    series[resolution] = [start, value, value, value, 1, value, ts]
+
+    def _close(self, app_id: str, metric: str, resolution: int, bucket: list):
+        self._closed.append(((app_id, metric, resolution), bucket))
+        unwritten = self._unwritten.setdefault((app_id, metric), {})
+        unwritten[resolution] = max(unwritten.get(resolution, float("-inf")), bucket[6])
+
+    def _written(self, closed: list):
+        """
+        Drop persisted buckets from the unwritten index.
+        """
+        with self._lock:
+            for (app_id, metric, resolution), bucket in closed:
+                unwritten = self._unwritten.get((app_id, metric))
+                if unwritten is None or unwritten.get(resolution, float("inf")) > bucket[6]:
+                    continue
+                del unwritten[resolution]
+                if not unwritten:
+                    del self._unwritten[(app_id, metric)]
+
+    def _stored_last_ts(self, series: set) -> dict:
+        """
+        Newest stored datapoint per resolution of each series:
+        {(app_id, metric): {resolution: timestamp}}, empty ones included.
+        """
+        found = {key: {} for key in series}
+        db: Session = Session_local()
+        try:
+            keys = [(uuid.UUID(str(app_id)), metric) for app_id, metric in series]
+            for start in range(0, len(keys), _UPSERT_CHUNK):
+                rows = db.execute(
+                    select(
+                        MetricRollup.application_id,
+                        MetricRollup.metric,
+                        MetricRollup.resolution,
+                        func.max(MetricRollup.last_ts)
+                    )
+                    .where(tuple_(MetricRollup.application_id, MetricRollup.metric).in_(keys[start:start + _UPSERT_CHUNK]))
+                    .group_by(MetricRollup.application_id, MetricRollup.metric, MetricRollup.resolution)
+                ).all()
+                for app_id, metric, resolution, last_ts in rows:
+                    key = (str(app_id), metric)
+                    if key in found:
+                        found[key][resolution] = last_ts.timestamp()
+        except Exception as e:
+            # Stored rows stay exact; only open buckets may repeat datapoints
+            print(f"[Rollup] Could not read stored buckets: {e}")
+        finally:
+            db.close()
+        return found
+
+    def _pending_last_ts(self, app_id: str, metric: str, seen: dict) -> dict:
+        """
+        seen, raised to the buckets of the series still waiting to be written.
+        """
+        seen = dict(seen)
+        pending = dict(self._unwritten.get((app_id, metric), {}))
+        for resolution, bucket in self._open.get(app_id, {}).get(metric, {}).items():
+            pending[resolution] = max(pending.get(resolution, float("-inf")), bucket[6])
+        for resolution, last_ts in pending.items():
+            seen[resolution] = max(seen.get(resolution, float("-inf")), last_ts)
+        return seen
+
+    def forget_app(self, app_id: str):
+        """
+        Close the buckets of an application that is no longer polled here.
+        """
+        with self._lock:
+            for metric, series in self._open.pop(app_id, {}).items():
+                for resolution, bucket in series.items():
+                    self._close(app_id, metric, resolution, bucket)
+            self._seen.pop(app_id, None)
+
+    def open_buckets(self, app_id: str, resolution: int) -> dict:
+        """
+        Copies of the still open buckets of an application: {metric: bucket}.
+        """
+        with self._lock:
+            return {
+                metric: list(series[resolution])
+                for metric, series in self._open.get(app_id, {}).items()
+                if resolution in series
+            }
+
+    def _close_expired(self, now: float):
+        for app_id, metrics in list(self._open.items()):
+            for metric, series in list(metrics.items()):
+                for resolution, bucket in list(series.items()):
+                    if bucket[0] + resolution + ROLLUP_CLOSE_GRACE < now:
+                        self._close(app_id, metric, resolution, series.pop(resolution))
+                if not series:
+                    del metrics[metric]
+            if not metrics:
+                del self._open[app_id]
+
+    def take_closed(self, close_all: bool = False) -> list:
+        """
+        Hand over the closed buckets (every bucket with close_all) for persisting.
+        """
+        with self._lock:
+            if close_all:
+                for app_id, metrics in self._open.items():
+                    for metric, series in metrics.items():
+                        for resolution, bucket in series.items():
+                            self._close(app_id, metric, resolution, bucket)
+                self._open = {}
+            else:
+                self._close_expired(time.time())
+            closed, self._closed = self._closed, []
+        return closed
+
+    def flush(self, close_all: bool = False) -> int:
+        """
+        Persist the closed buckets. Returns the number of rows written.
+        """
+        closed = self.take_closed(close_all)
+        if not closed:
+            return 0
+
+        db: Session = Session_local()
+        try:
+            # Buckets are rebuilt from the samples. The poller queues points
+            # for history before folding them in here, so this commits every
+            # datapoint of the buckets just taken
+            if self.history is not None:
+                self.history.flush()
+            count = upsert_rollups(db, closed)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Keep the buckets for the next attempt
+            with self._lock:
+                self._closed[:0] = closed
+            raise
+        finally:
+            db.close()
+        self._written(closed)
+        return count
+
+    def _run(self):
+        while not self._stop.wait(ROLLUP_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Rollup] Write failed: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop flushing and persist every bucket, open ones included.
+        """
+        self._stop.set()
+        try:
+            self.flush(close_all=True)
+        except Exception as e:
+            print(f"[Rollup] Final flush failed: {e}")
+
+
+def upsert_rollups(db: Session, closed: list) -> int:
+    """
+    Rebuild the buckets of the closed ones in observability.metric_rollups
+    from observability.metric_samples, so writing a bucket again (a restart
+    re-polling its lookback window, a backfill re-run) replaces it rather
+    than counting its datapoints twice. The samples must be stored first, in
+    the same transaction or before it; the caller commits.
+    """
+    keys = sorted({
+        (str(app_id), metric, resolution, start)
+        for (app_id, metric, resolution), (start, *_) in closed
+    })
+    for chunk_start in range(0, len(keys), _UPSERT_CHUNK):
+        chunk = keys[chunk_start:chunk_start + _UPSERT_CHUNK]
+        db.execute(_REBUILD_BUCKETS, {
+            "app_ids": [key[0] for key in chunk],
+            "metrics": [key[1] for key in chunk],
+            "resolutions": [key[2] for key in chunk],
+            "buckets": [datetime.fromtimestamp(key[3], timezone.utc) for key in chunk],
+        })
+    return len(keys)
+
+
+_REBUILD_BUCKETS = text("""
+    INSERT INTO observability.metric_rollups
+        (application_id, resolution, bucket, metric, min, max, sum, count, last, last_ts)
+    SELECT t.application_id, t.resolution, t.bucket, t.metric,
+           min(s.value), max(s.value), sum(s.value), count(*),
+           (array_agg(s.value ORDER BY s.ts DESC))[1], max(s.ts)
+    FROM unnest(
+        CAST(:app_ids AS uuid[]), CAST(:metrics AS text[]),
+        CAST(:resolutions AS integer[]), CAST(:buckets AS timestamptz[])
+    ) AS t(application_id, metric, resolution, bucket)
+    JOIN observability.metric_samples s
+      ON s.application_id = t.application_id
+     AND s.metric = t.metric
+     AND s.ts >= t.bucket
+     AND s.ts < t.bucket + make_interval(secs => t.resolution)
+    GROUP BY t.application_id, t.resolution, t.bucket, t.metric
+    ON CONFLICT (application_id, resolution, bucket, metric) DO UPDATE SET
+        min = EXCLUDED.min,
+        max = EXCLUDED.max,
+        sum = EXCLUDED.sum,
+        count = EXCLUDED.count,
+        last = EXCLUDED.last,
+        last_ts = EXCLUDED.last_ts
+""")
+
+
+def _bucket_json(start: datetime, low, high, total, count, last) -> dict:
+    return {
+        "timestamp": start.isoformat(),
+        "min": low,
+        "max": high,
+        "avg": total / count if count else None,
+        "sum": total,
+        "count": count,
+        "last": last,
+    }
+
+
+def query_rollups(db: Session, app_id, resolution: int, start: datetime, end: datetime,
+                  open_buckets: dict = None) -> dict:
+    """
+    Stored buckets of every metric of an application in [start, end), merged
+    with the still open ones when given. Returns {metric: [bucket, ...]}.
+    """
+    rows = db.execute(
+        select(
+            MetricRollup.metric,
+            MetricRollup.bucket,
+            MetricRollup.min,
+            MetricRollup.max,
+            MetricRollup.sum,
+            MetricRollup.count,
+            MetricRollup.last,
+            MetricRollup.last_ts
+        )
+        .where(
+            MetricRollup.application_id == app_id,
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket >= start,
+            MetricRollup.bucket < end
+        )
+        .order_by(MetricRollup.metric, MetricRollup.bucket)
+    ).all()
+
+    buckets = {
+        (row.metric, row.bucket.timestamp()): [row.min, row.max, row.sum, row.count, row.last, row.last_ts.timestamp()]
+        for row in rows
+    }
+    for metric, (bucket_start, low, high, total, count, last, last_ts) in (open_buckets or {}).items():
+        if not start.timestamp() <= bucket_start < end.timestamp():
+            continue
+        stored = buckets.get((metric, bucket_start))
+        if stored is None:
+            buckets[(metric, bucket_start)] = [low, high, total, count, last, last_ts]
+            continue
+        stored[0] = min(stored[0], low)
+        stored[1] = max(stored[1], high)
+        stored[2] += total
+        stored[3] += count
+        if last_ts >= stored[5]:
+            stored[4], stored[5] = last, last_ts
+
+    series = {}
+    for (metric, bucket_start), (low, high, total, count, last, _) in sorted(buckets.items()):
+        series.setdefault(metric, []).append(
+            _bucket_json(datetime.fromtimestamp(bucket_start, timezone.utc), low, high, total, count, last)
+        )
+    return series
@@ -0,0 +1,123 @@
+import heapq
+import random
+import threading
+from datetime import datetime
+from typing import Optional
+
+
+class PollScheduler:
+    """
+    Priority queue of (application, metric group) poll times.
+
+    Each group is due again one period after the newest datapoint it
+    returned, when CloudWatch will have started the next datapoint. Groups
+    whose data is late or missing are retried at a fraction of their period,
+    so daily S3 metrics are re-checked hourly rather than every 30 seconds.
+    Every due time carries random jitter so polls spread across the interval
+    instead of bursting at its start.
+
+    Times are wall-clock seconds because they are compared with CloudWatch
+    datapoint timestamps.
+    """
+
+    def __init__(self, interval: float, max_retry: float = 3600):
+        self.interval = interval
+        self.max_retry = max_retry
+        self._heap = []     # (due, app_id, group)
+        self._entries = {}  # (app_id, group) -> (due, period)
+        self._groups = {}   # app_id -> its scheduled groups
+        self._lock = threading.Lock()
+
+    def _retry_delay(self, period: float) -> float:
+        return min(max(period / 10, self.interval), self.max_retry)
+
+    def _jitter(self, period: float) -> float:
+        return random.uniform(0, min(self.interval, period / 10))
+
+    def _push(self, app_id: str, group: str, due: float, period: float):
+        self._entries[(app_id, group)] = (due, period)
+        self._groups.setdefault(app_id, set()).add(group)
+        heapq.heappush(self._heap, (due, app_id, group))
+
+    def add(self, app_id: str, group: str, period: float, now: float):
+        """
+        Schedule a new group somewhere within the next interval.
+        Groups that are already scheduled keep their due time and pick up
+        a changed period from their next poll on.
+        """
+        with self._lock:
+            entry = self._entries.get((app_id, group))
+            if entry is None:
+                self._push(app_id, group, now + random.uniform(0, self.interval), period)
+            elif entry[1] != period:
+                self._entries[(app_id, group)] = (entry[0], period)
+
+    def remove_app(self, app_id: str):
+        """
+        Forget every group of an application; stale heap items are skipped.
+        """
+        with self._lock:
+            for group in self._groups.pop(app_id, ()):
+                del self._entries[(app_id, group)]
+
+    def pop_due(self, now: float) -> list:
+        """
+        Return the (app_id, group) pairs that are due. They are provisionally
+        rescheduled for a retry, so a poll that never reports back is not lost.
+        """
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, app_id, group = heapq.heappop(self._heap)
+                entry = self._entries.get((app_id, group))
+                if entry is None or entry[0] != when:
+                    continue
+                period = entry[1]
+                self._push(app_id, group, now + self._retry_delay(period) + self._jitter(period), period)
+                due.append((app_id, group))
+        return due
+
+    def reschedule(self, app_id: str, group: str, last_datapoint: Optional[datetime], now: float):
+        """
+        Schedule the next poll of a group from the newest datapoint it returned.
+        """
+        with self._lock:
+            entry = self._entries.get((app_id, group))
+            if entry is None:
+                return
+            period = entry[1]
+
+            due = now + self._retry_delay(period)
+            if last_datapoint is not None:
+                next_datapoint = last_datapoint.timestamp() + period
+                if next_datapoint > now:
+                    due = min(next_datapoint, now + period)
+
+            self._push(app_id, group, due + self._jitter(period), period)
+
+    def defer(self, app_id: str, group: str, delay: float, now: float):
+        """
+        Push a group's next poll back by delay seconds, e.g. while its
+        account is being throttled.
+        """
+        with self._lock:
+            entry = self._entries.get((app_id, group))
+            if entry is None:
+                return
+            self._push(app_id, group, now + delay + self._jitter(entry[1]), entry[1])
+
+    def next_due(self) -> Optional[float]:
+        """
+        Earliest due time, or None when nothing is scheduled.
+        """
+        with self._lock:
+            while self._heap:
+                when, app_id, group = self._heap[0]
+                entry = self._entries.get((app_id, group))
+                if entry is not None and entry[0] == when:
+                    return when
+                heapq.heappop(self._heap)
+        return None
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,98 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+from database.database import Session_local
+from database.models import MetricStream
+
+# A stream row its worker has not touched for this long belongs to a worker
+# that is gone
+METRIC_STREAM_TTL = float(os.getenv("METRIC_STREAM_TTL", "60"))  # seconds
+
+
+class StreamRegistry:
+    """
+    The open /metrics/stream connections in observability.metric_streams.
+
+    A change made through any worker is written to the stream's row and
+    raises its version; the worker holding the stream picks it up on its
+    next sync (see MetricsHub), which also touches the rows of its open
+    streams and drops the ones no worker has touched for METRIC_STREAM_TTL.
+    Every call runs in a short-lived session of its own.
+    """
+
+    def open(self, stream_id: str, user_id, app_ids: list):
+        db: Session = Session_local()
+        try:
+            db.add(MetricStream(stream_id=stream_id, user_id=user_id, application_ids=list(app_ids), version=0))
+            db.commit()
+        finally:
+            db.close()
+
+    def close(self, stream_ids: list):
+        db: Session = Session_local()
+        try:
+            db.execute(delete(MetricStream).where(MetricStream.stream_id.in_(stream_ids)))
+            db.commit()
+        except Exception as e:
+            # Left for the TTL to drop
+            print(f"[Streams] Could not remove {len(stream_ids)} streams: {e}")
+        finally:
+            db.close()
+
+    def change(self, db: Session, stream_id: str, user_id, add: list, remove: list) -> Optional[tuple]:
+        """
+        Apply add and remove to a live stream of the user. Returns
+        (version, app_ids), or None when there is no such stream.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=METRIC_STREAM_TTL)
+        stream = db.execute(
+            select(MetricStream)
+            .where(
+                MetricStream.stream_id == stream_id,
+                MetricStream.user_id == user_id,
+                MetricStream.seen_at > cutoff
+            )
+            .with_for_update()
+        ).scalar_one_or_none()
+        if stream is None:
+            return None
+
+        removed = set(remove)
+        app_ids = [app_id for app_id in stream.application_ids if app_id not in removed]
+        app_ids += [app_id for app_id in dict.fromkeys(add) if app_id not in app_ids]
+        stream.application_ids = app_ids
+        stream.version += 1
+        version = stream.version
+        db.commit()
+        return version, app_ids
+
+    def sync(self, versions: dict) -> dict:
+        """
+        Touch the rows of this worker's streams ({stream_id: version held})
+        and return the ones changed since: {stream_id: (version, app_ids)}.
+        """
+        now = datetime.now(timezone.utc)
+        db: Session = Session_local()
+        try:
+            db.execute(
+                update(MetricStream)
+                .where(MetricStream.stream_id.in_(list(versions)))
+                .values(seen_at=now)
+            )
+            rows = db.execute(
+                select(MetricStream.stream_id, MetricStream.version, MetricStream.application_ids)
+                .where(MetricStream.stream_id.in_(list(versions)))
+            ).all()
+            db.execute(delete(MetricStream).where(
+                MetricStream.seen_at < now - timedelta(seconds=METRIC_STREAM_TTL)
+            ))
+            db.commit()
+        finally:
+            db.close()
+        return {
+            stream_id: (version, app_ids)
+            for stream_id, version, app_ids in rows
+            if version > versions[stream_id]
+        }
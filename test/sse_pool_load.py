@@ -0,0 +1,173 @@
+"""
+Load test: open many SSE streams against a running API and check that they
+hold no database connections.
+
+    python -m test.sse_pool_load --url http://127.0.0.1:8000 --token <jwt> --streams 1000
+
+Streams go to /metrics/stream (all of the user's applications) or, with
+--app-id, to /metrics/{app_id}/realtime. While they are open the
+db_stream_checked_out gauge of /internal/metrics (connections checked out
+by streaming requests; the poller and other background threads keep using
+the pool) must stay at 0 and ordinary API calls must not wait for the pool.
+Exits 1 otherwise.
+
+Uses only the standard library; raise the open file limit (ulimit -n) of
+both this process and the server above --streams first.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import urllib.request
+from urllib.parse import urlsplit, urlencode
+
+
+def scrape(url: str, metrics_token: str = None) -> dict:
+    """
+    Unlabelled samples of /internal/metrics, by name
+    """
+    request = urllib.request.Request(f"{url}/internal/metrics")
+    if metrics_token:
+        request.add_header("Authorization", f"Bearer {metrics_token}")
+    with urllib.request.urlopen(request, timeout=10) as response:
+        text = response.read().decode()
+
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#") or "{" in line:
+            continue
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+def timed_get(url: str, path: str, token: str) -> float:
+    request = urllib.request.Request(f"{url}{path}", headers={"Authorization": f"Bearer {token}"})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+async def open_stream(host: str, port: int, path: str, opened: asyncio.Event, state: dict):
+    """
+    Hold one SSE stream open until cancelled, counting it once its first
+    event arrived
+    """
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            "Accept: text/event-stream\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if b" 200 " not in status_line:
+            state["failed"] += 1
+            return
+        # Headers, then the first event (or heartbeat) ends with a blank line
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.readuntil(b"\n\n")
+        state["open"] += 1
+        if state["open"] + state["failed"] == state["wanted"]:
+            opened.set()
+
+        while await reader.read(65536):
+            pass
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        state["failed"] += 1
+        state["error"] = repr(e)
+    finally:
+        if state["open"] + state["failed"] == state["wanted"]:
+            opened.set()
+        if writer is not None:
+            writer.close()
+
+
+async def run(args) -> bool:
+    parts = urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+    query = urlencode({"token": args.token})
+    if args.app_id:
+        paths = [f"/metrics/{app_id}/realtime?{query}" for app_id in args.app_id]
+    else:
+        paths = [f"/metrics/stream?{query}"]
+
+    before = await asyncio.to_thread(scrape, args.url, args.metrics_token)
+    print(
+        f"[Load] Before: {before.get('db_pool_checked_out', 0):.0f} connections checked out, "
+        f"{before.get('db_stream_checked_out', 0):.0f} by streams"
+    )
+
+    state = {"wanted": args.streams, "open": 0, "failed": 0, "error": None}
+    opened = asyncio.Event()
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(open_stream(host, port, paths[i % len(paths)], opened, state))
+        for i in range(args.streams)
+    ]
+    try:
+        await asyncio.wait_for(opened.wait(), args.connect_timeout)
+    except asyncio.TimeoutError:
+        pass
+    print(
+        f"[Load] {state['open']} streams open, {state['failed']} failed "
+        f"in {time.perf_counter() - started:.1f}s"
+        + (f" (last error: {state['error']})" if state["error"] else "")
+    )
+
+    # Sample the connections held by the streams, and the whole pool for reference
+    peak = pool_peak = 0.0
+    samples = None
+    deadline = time.monotonic() + args.hold
+    while time.monotonic() < deadline:
+        samples = await asyncio.to_thread(scrape, args.url, args.metrics_token)
+        peak = max(peak, samples.get("db_stream_checked_out", 0))
+        pool_peak = max(pool_peak, samples.get("db_pool_checked_out", 0))
+        await asyncio.sleep(1)
+    print(
+        f"[Load] While streaming: peak {peak:.0f} connections checked out by streams "
+        f"({pool_peak:.0f} in all), sse_connections {samples.get('sse_connections', 0):.0f}"
+    )
+
+    # Ordinary API calls must still get a connection straight away
+    latencies = [
+        await asyncio.to_thread(timed_get, args.url, "/applications", args.token)
+        for _ in range(args.requests)
+    ]
+    print(
+        f"[Load] GET /applications during load: median {statistics.median(latencies) * 1000:.1f}ms, "
+        f"max {max(latencies) * 1000:.1f}ms"
+    )
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    ok = state["open"] == args.streams and peak == 0
+    print(f"[Load] {'PASS' if ok else 'FAIL'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that open SSE streams hold no database connections")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default=os.getenv("LOAD_TEST_TOKEN"), help="access token (or LOAD_TEST_TOKEN)")
+    parser.add_argument("--app-id", action="append", help="stream these applications one per connection instead of /metrics/stream")
+    parser.add_argument("--streams", type=int, default=1000)
+    parser.add_argument("--hold", type=float, default=10, help="seconds to sample the pool while streaming")
+    parser.add_argument("--requests", type=int, default=20, help="API calls to time while streaming")
+    parser.add_argument("--connect-timeout", type=float, default=60)
+    parser.add_argument("--metrics-token", default=os.getenv("INTERNAL_METRICS_TOKEN"))
+    args = parser.parse_args()
+
+    if not args.token:
+        parser.error("--token or LOAD_TEST_TOKEN is required")
+
+    sys.exit(0 if asyncio.run(run(args)) else 1)